@@ -15,6 +15,8 @@ sys.path.append(LIBRARY_PATH)
 
 from tn4.netbox.base import Context
 from tn4.netbox.client import Client
+from tn4.netbox.devices import VRRP_MASTERS, VRRP_BACKUPS
+from tn4.helper.lazy import LazyVars, materialize, pick
 from tn4.helper.utils import load_encrypted_secrets
 
 
@@ -39,9 +41,10 @@ class NetBox:
         self.inventory = None
 
 
-    def fetch_inventory(self, use_cache=False, fetch_all=False):
+    def fetch_inventory(self, use_cache=False, sync_cache=False, cache_format="binary", fetch_all=False):
         if self.nbdata is None:
-            self.nbdata = self.cli.fetch_as_inventory(ctx, use_cache=use_cache)
+            self.cli.set_cache_format(cache_format)
+            self.nbdata = self.cli.fetch_as_inventory(self.ctx, use_cache=use_cache, sync_cache=sync_cache)
 
         host_filter = lambda h: self.nbdata[h]["is_ansible_target"] or fetch_all
 
@@ -58,28 +61,27 @@ class NetBox:
             },
             "_meta": {
                 "hosts": {
-                    hostname: {
+                    hostname: LazyVars({
                         "hostname":       hostname,
-                        "is_vrrp_master": hostname in [ "core-honkan", "core-s7" ],
-                        "is_vrrp_backup": hostname in [ "core-gsic", "core-s1" ],
-                        **{
-                            key: self.nbdata[hostname][key]
-                            for key in [
-                                "ansible_host",
-                                "device_tags",
-                                "interfaces",
-                                "is_test_device",
-                                "lag_members",
-                                "manufacturer",
-                                "mgmt_vlan",
-                                "region",
-                                "role",
-                                "sitegp",
-                                "unprotected_irb_units",
-                                "vlans",
-                            ]
-                            if key in self.nbdata[hostname]
-                        },
+                        "is_vrrp_master": hostname in VRRP_MASTERS,
+                        "is_vrrp_backup": hostname in VRRP_BACKUPS,
+                    }) | pick(  # keep lazy values pending
+                        self.nbdata[hostname],
+                        [
+                            "ansible_host",
+                            "device_tags",
+                            "interfaces",
+                            "is_test_device",
+                            "lag_members",
+                            "manufacturer",
+                            "mgmt_vlan",
+                            "region",
+                            "role",
+                            "sitegp",
+                            "unprotected_irb_units",
+                            "vlans",
+                        ]
+                    ) | {
                         "datetime": self.ts,
                     }
                     for hostname in self.nbdata["_hostnames"] if host_filter(hostname)
@@ -93,12 +95,14 @@ class NetBox:
 if __name__ == "__main__":
     parser = ArgumentParser(description="Ansible - Dynamic Inventory Script")
     parser.add_argument("--use-cache", action="store_true", help="use NetBox cache if $HOME/.cache/tn4-player/*.cache available")
+    parser.add_argument("--sync-cache", action="store_true", help="sync NetBox cache with only updated objects")
+    parser.add_argument("--cache-format", choices=["binary", "json"], default="binary", help="format of exporting NetBox cache")
     #parser.add_argument("--debug",     action="store_true", help="debug mode")
     args = parser.parse_args()
 
     nb = NetBox()
     print(json.dumps(
-        nb.fetch_inventory(use_cache=args.use_cache),
+        materialize(nb.fetch_inventory(use_cache=args.use_cache, sync_cache=args.sync_cache, cache_format=args.cache_format)),
         indent=4,
         sort_keys=True,
         ensure_ascii=False
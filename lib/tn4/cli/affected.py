@@ -0,0 +1,99 @@
+from rich.console import Console
+import os
+import tempfile
+
+from tn4.cli.base import CommandBase
+from tn4.helper.store import SnapshotStore
+from tn4.netbox.diff import SnapshotDiff, load_snapshot
+
+
+class Affected(CommandBase):
+    ## logs go to stderr, so that the result can be passed to other commands (eg. tn4 deploy --hosts $(tn4 affected))
+    console = Console(log_time_format="%Y-%m-%dT%H:%M:%S", stderr=True)
+
+    def __init__(self, args):
+        self.netbox_url       = args.netbox_url
+        self.netbox_token     = args.netbox_token
+        self.flg_use_cache    = args.use_cache
+        self.flg_sync_cache   = args.sync_cache
+        self.flg_cache_format = args.cache_format
+        self.flg_debug        = args.debug
+        self.since_dir        = args.since
+        self.store            = SnapshotStore(f"{self.workdir_path}/project/snapshots")
+
+
+    def has_netbox_snapshot(self, run_dir):
+        manifest = self.store.load_manifest(run_dir) or {}
+        return os.path.isdir(f"{run_dir}/netbox") or any([ p.startswith("netbox/") for p in manifest.keys() ])
+
+
+    ## Return the deploy run having the NetBox snapshot, the latest one first
+    def lookup_latest_snapshot(self):
+        for run_dir in reversed(self.store.runs()):
+            if self.has_netbox_snapshot(run_dir):
+                return run_dir
+        return None
+
+
+    ## Return the directory of the NetBox cache files of the snapshot,
+    ## restoring them into the temporary directory if archived in the snapshot store
+    def lookup_netbox_dir(self, since_dir, tmpdir):
+        if os.path.isdir(f"{since_dir}/netbox"):
+            return f"{since_dir}/netbox"  # early return
+
+        if self.store.load_manifest(since_dir) is not None:
+            self.store.materialize(since_dir, tmpdir, prefix="netbox/")
+            return f"{tmpdir}/netbox"  # early return
+
+        return since_dir  # NetBox cache directory itself
+
+
+    def exec(self):
+        since_dir = self.since_dir
+        if since_dir is None:
+            since_dir = self.lookup_latest_snapshot()
+
+        if since_dir is None:
+            self.console.log("[red bold]No NetBox snapshot found. Deploy once or specify --since. Aborted.")
+            return 100
+
+        self.console.log(f"[yellow dim]Comparing with the NetBox snapshot: {since_dir}")
+
+        ok = self.fetch_inventory(
+            netbox_url=self.netbox_url, netbox_token=self.netbox_token,
+            use_cache=self.flg_use_cache, sync_cache=self.flg_sync_cache,
+            cache_format=self.flg_cache_format, debug=self.flg_debug
+        )
+
+        if not ok:
+            return 100
+
+        clients = { name: getattr(self.nb.cli, name) for name in self.nb.cli.dependencies.keys() }
+        _, cache_dir, _ = self.nb.cli.devices.lookup_cache_file(self.nb.cli.devices.path)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            old = load_snapshot(self.lookup_netbox_dir(since_dir, tmpdir), clients)
+            new = load_snapshot(cache_dir, clients)
+
+        if old is None or new is None:
+            self.console.log("[red bold]Incomplete NetBox snapshot or local cache. Aborted.")
+            return 100
+
+        with self.console.status(f"[green]Comparing NetBox snapshots..."):
+            diff = SnapshotDiff(old, new)
+
+            for name, n_changes in diff.count().items():
+                if n_changes > 0:
+                    self.console.log(f"[yellow dim]{n_changes} objects changed in {clients[name].path}")
+
+            hostname_of = lambda name: self.ctx.devices[name]["hostname"] if name in self.ctx.devices else None
+            hosts = [ h for h in diff.affected_hosts(hostname_of) if h in self.nb_inventory["_meta"]["hosts"] ]
+
+        if len(hosts) == 0:
+            self.console.log("[yellow]No hosts affected")
+            return 0
+
+        self.console.log(f"[yellow]Found {len(hosts)} affected hosts")
+        print(",".join(hosts))
+
+        return 0
@@ -1,11 +1,11 @@
 from collections import OrderedDict
 from pprint import pprint
 from rich.console import Console
+from types import MappingProxyType
 from yaml import safe_load
 import copy
 import os
 import sys
-import time
 
 CURDIR            = os.path.dirname(__file__)
 ANSIBLE_WORKDIR   = os.path.join(CURDIR, "../../..")
@@ -23,10 +23,14 @@ class CommandBase:
 
     inventory_path   = ANSIBLE_INVENTORY
     workdir_path     = ANSIBLE_WORKDIR
+    project_path     = ANSIBLE_PROJECT
     main_task_path   = f"{ANSIBLE_PROJECT}/tn4.yml"
     ansible_cfg_path = f"{ANSIBLE_WORKDIR}/ansible.cfg"
     group_vars_path  = f"{ANSIBLE_INVENTORY}/group_vars/all/ansible.yml"
 
+    ## Fetch interfaces and addresses of only the filtered hosts if they are fewer than this
+    max_pushdown_hosts = 100
+
     template_paths = {
         Slug.Manufacturer.Cisco: {
             Slug.Role.EdgeSW: [
@@ -47,6 +51,19 @@ class CommandBase:
     }
 
 
+    ## Return template paths of each manufacturer and role, replaced with the custom template if given
+    def load_template_paths(self):
+        template_paths = {}
+
+        for manufacturer in self.template_paths.keys():
+            for role, paths in self.template_paths[manufacturer].items():
+                if self.custom_template_path is not None:
+                    paths = [ self.custom_template_path ]
+                template_paths.setdefault(manufacturer, {})[role] = paths
+
+        return template_paths
+
+
     ## CAUTION: filter_hosts() and fetch_inventory() are TIGHT coupling
     def filter_hosts(self, hosts=[], no_hosts=[], areas=[], no_areas=[], roles=[], no_roles=[],
                      vendors=[], no_vendors=[], tags=[], no_tags=[]):
@@ -122,8 +139,9 @@ class CommandBase:
 
     def fetch_inventory(self, hosts=[], no_hosts=[], areas=[], no_areas=[], roles=[], no_roles=[],
                         vendors=[], no_vendors=[], tags=[], no_tags=[],
-                        netbox_url=None, netbox_token=None, use_cache=False, debug=False, fetch_all=False):
+                        netbox_url=None, netbox_token=None, use_cache=False, sync_cache=False, cache_format="binary", debug=False, fetch_all=False):
         nb = NetBox(url=netbox_url, token=netbox_token)
+        nb.cli.set_cache_format(cache_format)
 
         self.console.log(f"[yellow dim]NetBox API endpoint: {nb.ctx.endpoint}")
         self.console.log(f"[yellow dim]NetBox API token:    {nb.ctx.token}")
@@ -131,55 +149,54 @@ class CommandBase:
         m = "Fetching the latest inventory from NetBox, this may take a while..."
         if use_cache:
             m = "Loading local cache and rebuilding inventory, this usually takes less than few seconds..."
-        annotation = "[green bold dim]using cache" if use_cache else ""
+        elif sync_cache:
+            m = "Syncing local cache with NetBox and rebuilding inventory..."
+
+        annotation = ""
+        if use_cache:
+            annotation = "[green bold dim]using cache"
+        elif sync_cache:
+            annotation = "[green bold dim]syncing cache"
+
+        def log_loading(client, et):
+            self.console.log(f"[yellow]Loading finished from {client.path} in {round(et, 1)} sec {annotation}")
+
+        ## NOTE:
+        ## NetBox filters can not express the conditions of filter_hosts() (negations, typo detection),
+        ## so the devices are filtered here and the result is pushed down to the larger endpoints
+        ## The hosts filtered in scope() are reused below, the filters only read the device-level hostvars
+        target_hosts = None
+
+        def scope(devices):
+            nonlocal target_hosts
+            nb.nbdata = devices
+            self.nb_inventory = nb.fetch_inventory(fetch_all=fetch_all)
+
+            target_hosts = self.filter_hosts(hosts, no_hosts, areas, no_areas,
+                                             roles, no_roles, vendors, no_vendors, tags, no_tags)
+            scoped_hosts = nb.cli.devices.lookup_dependencies(nb.ctx, target_hosts)
+
+            if len(scoped_hosts) > self.max_pushdown_hosts:
+                return None  # early return
+
+            self.console.log(f"[yellow dim]Fetching interfaces and addresses of {len(scoped_hosts)} hosts only")
+            return nb.cli.devices.lookup_device_ids(nb.ctx, scoped_hosts)
+
+        is_filtered = any([ hosts, no_hosts, areas, no_areas, roles, no_roles, vendors, no_vendors, tags, no_tags ])
+        is_scoped   = is_filtered and not use_cache and not sync_cache
 
         with self.console.status(f"[green]{m}"):
-            start_at = time.time()
-            nb.cli.sites.fetch_as_inventory(nb.ctx, use_cache=use_cache)
-            et = round(time.time() - start_at, 1)
-            self.console.log(f"[yellow]Loading finished from {nb.cli.sites.path} in {et} sec {annotation}")
-
-            start_at = time.time()
-            nb.cli.vlans.fetch_as_inventory(nb.ctx, use_cache=use_cache)
-            et = round(time.time() - start_at, 1)
-            self.console.log(f"[yellow]Loading finished from {nb.cli.vlans.path} in {et} sec {annotation}")
-
-            start_at = time.time()
-            nb.cli.addresses.fetch_as_inventory(nb.ctx, use_cache=use_cache)
-            et = round(time.time() - start_at, 1)
-            self.console.log(f"[yellow]Loading finished from {nb.cli.addresses.path} in {et} sec {annotation}")
-
-            start_at = time.time()
-            nb.cli.prefixes.fetch_as_inventory(nb.ctx, use_cache=use_cache)
-            et = round(time.time() - start_at, 1)
-            self.console.log(f"[yellow]Loading finished from {nb.cli.prefixes.path} in {et} sec {annotation}")
-
-            start_at = time.time()
-            nb.cli.fhrp_groups.fetch_as_inventory(nb.ctx, use_cache=use_cache)
-            et = round(time.time() - start_at, 1)
-            self.console.log(f"[yellow]Loading finished from {nb.cli.fhrp_groups.path} in {et} sec {annotation}")
-
-            start_at = time.time()
-            nb.cli.fhrp_group_assignments.fetch_as_inventory(nb.ctx, use_cache=use_cache)
-            et = round(time.time() - start_at, 1)
-            self.console.log(f"[yellow]Loading finished from {nb.cli.fhrp_group_assignments.path} in {et} sec {annotation}")
-
-            start_at = time.time()
-            devices = nb.cli.devices.fetch_as_inventory(nb.ctx, use_cache=use_cache)
-            et = round(time.time() - start_at, 1)
-            self.console.log(f"[yellow]Loading finished from {nb.cli.devices.path} in {et} sec {annotation}")
-
-            start_at = time.time()
-            interfaces = nb.cli.interfaces.fetch_as_inventory(nb.ctx, use_cache=use_cache)
-            et = round(time.time() - start_at, 1)
-            self.console.log(f"[yellow]Loading finished from {nb.cli.interfaces.path} in {et} sec {annotation}")
+            results = nb.cli.fetch_all(nb.ctx, use_cache=use_cache, sync_cache=sync_cache, callback=log_loading,
+                                       scope=scope if is_scoped else None)
+            devices, interfaces = results["devices"], results["interfaces"]
 
             nb.nbdata = nb.cli.merge_inventory(devices, interfaces)
             self.nb_inventory = nb.fetch_inventory(fetch_all=fetch_all)
             self.console.log(f"[yellow]Building Titanet4 inventory completed")
 
-        target_hosts = self.filter_hosts(hosts, no_hosts, areas, no_areas,
-                                         roles, no_roles, vendors, no_vendors, tags, no_tags)
+        if target_hosts is None:
+            target_hosts = self.filter_hosts(hosts, no_hosts, areas, no_areas,
+                                             roles, no_roles, vendors, no_vendors, tags, no_tags)
 
         self.ansible_common_vars = {}
         with open(self.group_vars_path) as fd:
@@ -208,9 +225,13 @@ class CommandBase:
             self.console.log("[red bold]No hosts found. Check the typos of your condition or devices' tags on NetBox")
             sys.exit(1)
 
+        ## NOTE:
+        ## No need to deep-copy the whole campus, nothing below modifies NetBox objects in place.
+        ## Context is shallow-copied since its attributes are replaced, and hostvars are replaced
+        ## by private copies by the commands modifying them (see Deploy.append_ansible_common_vars).
         self.nb     = nb
-        self.nbdata = copy.deepcopy(nb.nbdata)
-        self.ctx    = copy.deepcopy(nb.ctx)
+        self.nbdata = MappingProxyType(nb.nbdata)  # read-only view
+        self.ctx    = copy.copy(nb.ctx)
 
         self.ctx.interfaces = {
             hostname: interfaces
@@ -7,13 +7,15 @@ from tn4.doctor.branch import BranchInfo, Branch
 
 class BranchVlan(CommandBase):
     def __init__(self, args):
-        self.netbox_url    = args.netbox_url
-        self.netbox_token  = args.netbox_token
-        self.flg_debug     = args.debug
-        self.flg_use_cache = args.use_cache
+        self.netbox_url       = args.netbox_url
+        self.netbox_token     = args.netbox_token
+        self.flg_debug        = args.debug
+        self.flg_use_cache    = args.use_cache
+        self.flg_sync_cache   = args.sync_cache
+        self.flg_cache_format = args.cache_format
 
-        self.flg_add       = args.add
-        self.flg_delete    = args.delete
+        self.flg_add          = args.add
+        self.flg_delete       = args.delete
 
         if self.flg_add:
             self.branch_info = BranchInfo(
@@ -143,7 +145,8 @@ class BranchVlan(CommandBase):
     def exec(self):
         ok = self.fetch_inventory(
             netbox_url=self.netbox_url, netbox_token=self.netbox_token,
-            use_cache=self.flg_use_cache, debug=self.flg_debug, fetch_all=True
+            use_cache=self.flg_use_cache, sync_cache=self.flg_sync_cache,
+            cache_format=self.flg_cache_format, debug=self.flg_debug, fetch_all=True
         )
 
         if not ok:
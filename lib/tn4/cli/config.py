@@ -1,8 +1,9 @@
-from jinja2 import FileSystemLoader, Environment
 import os
 import json
 
 from tn4.cli.base import CommandBase
+from tn4.helper.lazy import materialize, referenced_names
+from tn4.helper.render import Renderer, hostvar_digest, template_digest
 
 
 class Config(CommandBase):
@@ -12,12 +13,17 @@ class Config(CommandBase):
         self.netbox_token          = args.netbox_token
         self.outdir                = args.private_dir
         self.inventory_json        = f"{self.outdir}/inventory.json"
+        self.manifest_json         = f"{self.outdir}/.manifest.json"
 
         self.custom_template_path  = args.custom_j2_path
         self.flg_debug             = args.debug
         self.flg_inventory         = args.as_inventory
         self.flg_remote_fetch      = args.remote_fetch
         self.flg_use_cache         = args.use_cache
+        self.flg_sync_cache        = args.sync_cache
+        self.flg_cache_format      = args.cache_format
+        self.jobs                  = args.jobs
+        self.flg_incremental       = args.incremental
         self.fetch_inventory_opts  = [
             args.hosts,   args.no_hosts,
             args.areas,   args.no_areas,
@@ -37,6 +43,12 @@ class Config(CommandBase):
             commit_confirm_min=1,  # same as above
             overwrite_j2_path=None,
             early_exit=False,
+            force_all=False,
+            shards=None,
+            shard_by="vendor",
+            waves=False,
+            wave_forks=None,
+            max_failure_rate=None,
             v=None,
         )
         deploy = Deploy(Namespace(**deploy_opt))
@@ -46,40 +58,70 @@ class Config(CommandBase):
         return deploy.exec()
 
 
-    def load_templates(self, trim_blocks):
-        self.templates = {}
+    def load_manifest(self):
+        try:
+            with open(self.manifest_json) as fd:
+                return json.load(fd)
+        except Exception as e:
+            return {}
 
-        for manufacturer in self.template_paths.keys():
-            for role, paths in self.template_paths[manufacturer].items():
-                if self.custom_template_path is not None:
-                    paths = [ self.custom_template_path ]
 
-                for path in paths:
-                    l = FileSystemLoader(os.path.dirname(path))
-                    e = Environment(loader=l, trim_blocks=trim_blocks)
-                    t = e.get_template(os.path.basename(path))
-                    self.templates.setdefault(manufacturer, {}).setdefault(role, []).append(t)
+    ## Return fingerprints of hosts, which are the hashes of their hostvars and templates
+    def fingerprint(self, template_paths, names, trim_blocks):
+        fingerprints = {}
+        template_digests = {}
 
+        for host, hostvar in self.inventory["_meta"]["hosts"].items():
+            materialize(hostvar, names)  # lazy hostvars read by the templates
 
-    def render(self, trim_blocks=False):
-        self.load_templates(trim_blocks)
-        self.configs = {}
-        ignore_empty_lines = lambda s: "\n".join([l for l in s.split("\n") if l != ""])
+            key = (hostvar["manufacturer"], hostvar["role"])
+            if key not in template_digests:
+                template_digests[key] = template_digest(template_paths[key[0]][key[1]], trim_blocks)
 
-        for host, hostvar in self.inventory["_meta"]["hosts"].items():
-            config = []
+            fingerprints[host] = f"{template_digests[key]}:{hostvar_digest(hostvar)}"
 
-            for template in self.templates[hostvar["manufacturer"]][hostvar["role"]]:
-                try:
-                    raw = template.render(hostvar)
-                except Exception as e:
-                    ip = hostvar["ansible_host"]
-                    self.console.log(f"[red bold]An exception occurred while rendering {host} ({ip}). Skipped.")
-                    self.console.log(f"[red bold dim]{e}")
-                else:
-                    config.append(ignore_empty_lines(raw))
+        return fingerprints
 
-            self.configs[host] = "\n".join(config)
+
+    def render(self, trim_blocks=False):
+        template_paths = self.load_template_paths()
+        template_dirs  = { os.path.dirname(p) for roles in template_paths.values() for ps in roles.values() for p in ps }
+
+        ## lazy hostvars are computed only if the templates may read them
+        names = referenced_names(*template_dirs)
+        renderer = Renderer(template_paths, names, trim_blocks=trim_blocks, jobs=self.jobs)
+        hosts = self.inventory["_meta"]["hosts"]
+
+        if self.flg_incremental:
+            manifest = self.load_manifest()
+            fingerprints = self.fingerprint(template_paths, names, trim_blocks)
+
+            hosts = {
+                host: hostvar
+                for host, hostvar in hosts.items()
+                if manifest.get(host) != fingerprints[host] or not os.path.exists(f"{self.outdir}/{host}.cfg")
+            }
+
+            n_skipped = len(self.inventory["_meta"]["hosts"]) - len(hosts)
+            self.console.log(f"[yellow]Found {len(hosts)} changed hosts, skipped {n_skipped} unchanged hosts")
+            if len(hosts) > 0:
+                self.console.log(f"[yellow dim]{', '.join(hosts.keys())}")
+
+        for host, errors, _ in renderer.render(self.outdir, hosts):
+            for e in errors:
+                ip = hosts[host]["ansible_host"]
+                self.console.log(f"[red bold]An exception occurred while rendering {host} ({ip}). Skipped.")
+                self.console.log(f"[red bold dim]{e}")
+
+            ## hosts failed to render are rendered again in the next run
+            if self.flg_incremental:
+                manifest.pop(host, None)
+                if len(errors) == 0:
+                    manifest[host] = fingerprints[host]
+
+        if self.flg_incremental:
+            with open(self.manifest_json, "w") as fd:
+                json.dump(manifest, fd, indent=4, sort_keys=True)
 
 
     def exec(self):
@@ -89,7 +131,8 @@ class Config(CommandBase):
         ok = self.fetch_inventory(
             *self.fetch_inventory_opts,
             netbox_url=self.netbox_url, netbox_token=self.netbox_token,
-            use_cache=self.flg_use_cache, debug=self.flg_debug
+            use_cache=self.flg_use_cache, sync_cache=self.flg_sync_cache,
+            cache_format=self.flg_cache_format, debug=self.flg_debug
         )
 
         if not ok:
@@ -98,19 +141,14 @@ class Config(CommandBase):
         if self.flg_inventory:
             with self.console.status(f"[green]Exporting raw inventory..."):
                 with open(self.inventory_json, "w") as fd:
-                    json.dump(self.inventory, fd, indent=4, sort_keys=True, ensure_ascii=False)
+                    json.dump(materialize(self.inventory), fd, indent=4, sort_keys=True, ensure_ascii=False)
                 self.console.log(f"[yellow]Exporting inventory finished at {self.inventory_json}")
             return 0
 
-        with self.console.status(f"[green]Rendering configs..."):
+        ## rendered configs are exported by the renderer as soon as each host is rendered
+        with self.console.status(f"[green]Rendering and exporting configs..."):
             self.render()
             self.console.log(f"[yellow]Rendering configs finished")
-
-        with self.console.status(f"[green]Exporting rendered configs..."):
-            for host in self.configs:
-                cfg = f"{self.outdir}/{host}.cfg"
-                with open(cfg, "w") as fd:
-                    fd.write(self.configs[host])
             self.console.log(f"[yellow]Exporting rendered configs finished at {self.outdir}")
 
         return 0
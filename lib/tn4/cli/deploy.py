@@ -1,23 +1,48 @@
 from ansible_runner import run
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pprint import pprint
+from rich import box
+from rich.table import Table
+import hashlib
+import json
+import shutil
 import time
 import os
 
 from tn4.cli.base import CommandBase
+from tn4.helper.lazy import materialize, referenced_names
+from tn4.helper.ledger import update_ledger
+from tn4.helper.render import Renderer
+from tn4.helper.store import SnapshotStore
+from tn4.helper.timing import TimingReport
+from tn4.netbox.cache import atomic_write
+from tn4.netbox.slug import Slug
 
 
 class Deploy(CommandBase):
+    ## Number of the slowest hosts shown in the timing report
+    timing_top = 10
+
     def __init__(self, args):
         self.netbox_url            = args.netbox_url
         self.netbox_token          = args.netbox_token
         self.flg_use_cache         = args.use_cache
+        self.flg_sync_cache        = args.sync_cache
+        self.flg_cache_format      = args.cache_format
         self.flg_dryrun            = args.dryrun
         self.flg_early_exit        = args.early_exit
+        self.flg_force_all         = args.force_all
         self.flg_debug             = args.debug
         self.custom_template_path  = args.overwrite_j2_path
         self.commit_confirm_min    = 0 if args.commit_confirm_min is None else args.commit_confirm_min
         self.verbosity             = args.v
+        self.jobs                  = args.jobs
+        self.shards                = 1 if args.shards is None else args.shards
+        self.shard_by              = args.shard_by
+        self.flg_waves             = args.waves
+        self.wave_forks            = args.wave_forks
+        self.max_failure_rate      = 0 if args.max_failure_rate is None else args.max_failure_rate
         self.fetch_inventory_opts  = [
             args.hosts,   args.no_hosts,
             args.areas,   args.no_areas,
@@ -31,6 +56,9 @@ class Deploy(CommandBase):
         n = datetime.now()
         ts = n.strftime("%Y-%m-%d@%H-%M-%S")
         self.snapshot_basedir = f"{self.workdir_path}/project/snapshots/config.{ts}"
+        self.ledger_json      = f"{self.workdir_path}/project/snapshots/ledger.json"
+        self.store            = SnapshotStore(f"{self.workdir_path}/project/snapshots")
+        self.ts               = ts
 
 
     def append_ansible_common_vars(self):
@@ -45,15 +73,349 @@ class Deploy(CommandBase):
             "snapshot_basedir":   self.snapshot_basedir,
         }
 
-        for host in self.inventory["_meta"]["hosts"].values():
-            host |= self.ansible_common_vars
+        ## copy-on-write, hostvars are shared with the NetBox inventory
+        hosts = self.inventory["_meta"]["hosts"]
+        for hostname, hostvar in hosts.items():
+            hosts[hostname] = hostvar | self.ansible_common_vars
+
+        ## Ansible Runner exports the inventory as JSON,
+        ## so lazy hostvars are computed here only if the playbooks or templates may read them
+        paths = [ self.project_path ]
+        if self.custom_template_path is not None:
+            paths.append(self.custom_template_path)
+        materialize(self.inventory, referenced_names(*paths))
+
+
+    ## NOTE:
+    ## Configs are rendered here in parallel, in the same way as Ansible's template lookup
+    ## (trim_blocks enabled and empty lines removed), instead of rendering them in the playbooks.
+    ## Ansible magic variables (inventory_hostname, group_names, groups and hostvars) are also given,
+    ## since custom templates of --overwrite used to be rendered by the playbooks and may read them.
+    ## Hosts failed to render are excluded from the inventory not to be deployed.
+    def prerender(self):
+        template_paths = self.load_template_paths()
+        template_dirs  = { os.path.dirname(p) for roles in template_paths.values() for ps in roles.values() for p in ps }
+
+        hosts  = self.inventory["_meta"]["hosts"]
+        groups = { "all": list(hosts.keys()) } | {
+            name: list(group["hosts"].keys()) for name, group in self.inventory.items() if name != "_meta"
+        }
+
+        renderer = Renderer(template_paths, referenced_names(*template_dirs), trim_blocks=True, jobs=self.jobs,
+                            suffix="_submitted.cfg", groups=groups)
+        failed_hosts = []
+
+        for host, errors, et in renderer.render(self.snapshot_basedir, hosts):
+            self.timing.add(host, "render", et)
+
+            for e in errors:
+                ip = hosts[host]["ansible_host"]
+                self.console.log(f"[red bold]An exception occurred while rendering {host} ({ip}). Skipped.")
+                self.console.log(f"[red bold dim]{e}")
+
+            if len(errors) > 0:
+                failed_hosts.append(host)
+            else:
+                hosts[host]["submitted_cfg_path"] = f"{self.snapshot_basedir}/{host}_submitted.cfg"
+
+        self.exclude_hosts(failed_hosts)
+        return len(hosts)
+
+
+    def exclude_hosts(self, excluded_hosts):
+        for host in excluded_hosts:
+            for group in self.inventory.values():
+                if "hosts" in group and host in group["hosts"]:
+                    del group["hosts"][host]  # including _meta
+
+
+    ## Ledger of the configs successfully applied
+    ##  - key:   hostname
+    ##  - value: sha256 of the last committed _submitted.cfg and its timestamp
+    def load_ledger(self):
+        try:
+            with open(self.ledger_json) as fd:
+                return json.load(fd)
+        except Exception as e:
+            return {}
+
+
+    def lookup_submitted_digests(self):
+        digests = {}
+        for host, hostvar in self.inventory["_meta"]["hosts"].items():
+            with open(hostvar["submitted_cfg_path"], "rb") as fd:
+                digests[host] = hashlib.sha256(fd.read()).hexdigest()
+        return digests
+
+
+    ## Exclude hosts whose rendered config is the same as the last applied one
+    def exclude_unchanged_hosts(self, ledger, digests):
+        unchanged_hosts = [
+            host for host in self.inventory["_meta"]["hosts"].keys()
+            if ledger.get(host, {}).get("sha256") == digests[host]
+        ]
+
+        self.exclude_hosts(unchanged_hosts)
+        return unchanged_hosts
+
+
+    def update_ledger(self, ledger, digests, stats):
+        update_ledger(ledger, self.inventory["_meta"]["hosts"], digests, stats, self.ts,
+                      commit_confirm_min=self.commit_confirm_min, is_overwrite=self.custom_template_path is not None)
+
+        if self.commit_confirm_min > 0:
+            self.console.log("[yellow dim]Juniper hosts committed with --commit-confirm are not recorded in the ledger")
+
+        atomic_write(self.ledger_json, json.dumps(ledger, indent=4, sort_keys=True).encode())
+
+
+    ## Save the local NetBox cache used for this deploy, which is compared by 'tn4 affected' later
+    ##  - is_all_hosts: whether the rendered hosts were all hosts of NetBox, including the unchanged ones
+    ## NOTE:
+    ## 'tn4 affected' regards all hosts as deployed with the saved cache, so it is saved
+    ## only if no hosts were filtered out, failed, unreachable, nor skipped by the waves.
+    ## The cache is not updated when the fetching is scoped to the target hosts, so it is not saved either.
+    def save_netbox_snapshot(self, stats, is_all_hosts):
+        failed_hosts = set(stats.get("failures", {}).keys()) | set(stats.get("dark", {}).keys())
+        processed    = stats.get("processed", self.inventory["_meta"]["hosts"])
+
+        is_all_deployed  = is_all_hosts and len(failed_hosts) == 0
+        is_all_deployed &= all(host in processed for host in self.inventory["_meta"]["hosts"].keys())
+
+        if self.ctx.device_ids is not None or not is_all_deployed:
+            self.console.log("[yellow dim]NetBox snapshot is not saved since not all hosts are deployed")
+            return  # early return
+
+        snapshot_dir = f"{self.snapshot_basedir}/netbox"
+        os.makedirs(snapshot_dir, exist_ok=True)
+
+        for name in self.nb.cli.dependencies.keys():
+            client = getattr(self.nb.cli, name)
+            _, _, cache_path = client.lookup_cache_file(client.path)
+
+            for path in [ cache_path, cache_path + ".meta" ]:
+                if os.path.exists(path):
+                    shutil.copy2(path, snapshot_dir)
+
+
+    ## Return the inventory having only the given hosts
+    def subset_inventory(self, members):
+        hosts = self.inventory["_meta"]["hosts"]
+
+        return {
+            **{
+                group: { "hosts": { h: {} for h in v["hosts"] if h in members } }
+                for group, v in self.inventory.items() if group != "_meta"
+            },
+            "_meta": {
+                "hosts": { h: hosts[h] for h in members }
+            }
+        }
+
+
+    ## Partition the hosts of the inventory into the inventories of shards
+    ##  - vendor, region: one shard per manufacturer or region
+    ##  - host:           hosts are split evenly into the given number of shards
+    def partition_hosts(self, inventory):
+        shard_hosts = {}
+
+        for i, (host, hostvar) in enumerate(inventory["_meta"]["hosts"].items()):
+            match self.shard_by:
+                case "vendor":
+                    name = hostvar["manufacturer"]
+                case "region":
+                    name = hostvar["region"]
+                case _:
+                    name = f"shard{i % self.shards}"
+            shard_hosts.setdefault(name, []).append(host)
+
+        return { name: self.subset_inventory(members) for name, members in shard_hosts.items() }
+
+
+    ## Merge the stats of the runs, hosts of the runs without stats are regarded as unreachable
+    ##  - runs: list of inventory and stats
+    @staticmethod
+    def merge_stats(runs):
+        merged = {}
+
+        for inventory, stats in runs:
+            if stats is None:
+                stats = { "dark": { h: 1 for h in inventory["_meta"]["hosts"].keys() } }
+
+            for key, counts in stats.items():
+                merged.setdefault(key, {}).update(counts)
+
+        return merged
+
+
+    ## Run Ansible Runner instances of the shards concurrently, up to the number of shards at once
+    ## NOTE:
+    ## Each shard has its own private data dir (inventory and artifacts) under the snapshot dir,
+    ## sharing group_vars by symlink. The outputs are not interleaved on the terminal
+    ## but saved as artifacts/<ident>/stdout of each shard.
+    def run_shards(self, run_opts, inventory, prefix=""):
+        inventories = self.partition_hosts(inventory)
+        results, elapsed = {}, {}
+
+        def run_shard(name):
+            private_data_dir = f"{self.snapshot_basedir}/runner/{prefix}{name}"
+            os.makedirs(f"{private_data_dir}/inventory", exist_ok=True)
+
+            group_vars = f"{private_data_dir}/inventory/group_vars"
+            os.path.lexists(group_vars) or os.symlink(os.path.abspath(f"{self.inventory_path}/group_vars"), group_vars)
+
+            start_at = time.time()
+            r = run(**run_opts, inventory=inventories[name], private_data_dir=private_data_dir, quiet=True,
+                    event_handler=self.timing.event_handler)
+            elapsed[name] = round(time.time() - start_at, 1)
+            return r
+
+        self.console.log(f"[yellow dim]Running {len(inventories)} shards by {self.shard_by}, up to {self.shards} at once")
+
+        with ThreadPoolExecutor(max_workers=self.shards) as executor:
+            for name, r in zip(inventories.keys(), executor.map(run_shard, inventories.keys())):
+                results[name] = r
+
+        for name, r in results.items():
+            n_hosts = len(inventories[name]["_meta"]["hosts"])
+            color = "yellow" if r.status == "successful" else "red bold"
+            self.console.log(f"[{color}]Shard {name}: {n_hosts} hosts, {r.status} (rc={r.rc}) in {elapsed[name]} sec")
+            self.console.log(f"[{color} dim]{r.config.artifact_dir}/stdout")
+
+        return self.merge_stats([ (inventories[name], r.stats) for name, r in results.items() ])
+
+
+    ## Run Ansible Runner for the inventory, in shards if --shards is given
+    def run_ansible(self, run_opts, inventory, prefix=""):
+        if self.shards > 1:
+            return self.run_shards(run_opts, inventory, prefix)  # early return
+
+        ## workaround: https://github.com/ansible/ansible-runner/issues/702
+        hosts_json = f"{self.inventory_path}/hosts.json"
+        os.path.exists(hosts_json) and os.remove(hosts_json)
+
+        print("\n"*0)  # terminal margin
+        r = run(**run_opts, inventory=inventory, private_data_dir=self.workdir_path,
+                event_handler=self.timing.event_handler)
+        print("\n"*1)  # terminal margin
+
+        return self.merge_stats([ (inventory, r.stats) ])
+
+
+    ## Build the rollout waves in order
+    ##  - canary:      test devices
+    ##  - edge.<gp>:   Edge SWs of each site group
+    ##  - core.backup: Core SWs other than the VRRP masters
+    ##  - core.master: VRRP master Core SWs
+    ## NOTE:
+    ## Hosts of other roles are deployed after the Edge SWs, as a wave of each role.
+    def build_waves(self):
+        waves = {}
+        rank  = {}
+        vrrp_masters = self.nb.cli.devices.vrrp_masters
+
+        for host, hostvar in self.inventory["_meta"]["hosts"].items():
+            if hostvar["is_test_device"]:
+                name, rank["canary"] = "canary", 0
+            elif hostvar["role"] == Slug.Role.EdgeSW:
+                name = f"edge.{hostvar['sitegp']}"
+                rank[name] = 1
+            elif hostvar["role"] == Slug.Role.CoreSW and host in vrrp_masters:
+                name, rank["core.master"] = "core.master", 4
+            elif hostvar["role"] == Slug.Role.CoreSW:
+                name, rank["core.backup"] = "core.backup", 3
+            else:
+                name = hostvar["role"]
+                rank[name] = 2
+            waves.setdefault(name, []).append(host)
+
+        return { name: waves[name] for name in sorted(waves.keys(), key=lambda name: (rank[name], name)) }
+
+
+    ## Run the waves one by one, stopping the rollout if the failure rate of a wave exceeds the threshold
+    ## NOTE:
+    ## Any failure of the canaries stops the rollout regardless of the threshold.
+    ## Hosts of the skipped waves have no stats, so they are not recorded in the ledger.
+    def run_waves(self, run_opts):
+        waves = self.build_waves()
+        runs, report = [], []
+
+        if self.wave_forks is not None:
+            run_opts = run_opts | { "envvars": run_opts["envvars"] | { "ANSIBLE_FORKS": str(self.wave_forks) } }
+
+        for i, (name, members) in enumerate(waves.items()):
+            self.console.log(f"[yellow]Wave {i+1}/{len(waves)} {name}: {len(members)} hosts")
+            self.console.log(f"[yellow dim]{', '.join(members)}")
+
+            inventory = self.subset_inventory(members)
+            start_at = time.time()
+            stats = self.run_ansible(run_opts, inventory, prefix=f"{name}.")
+            runs.append((inventory, stats))
+
+            et = round(time.time() - start_at, 1)
+            failed_hosts = sorted(set(stats.get("failures", {}).keys()) | set(stats.get("dark", {}).keys()))
+            failure_rate = len(failed_hosts) / len(members)
+            report.append((name, len(members), len(failed_hosts), et))
+
+            color = "yellow" if len(failed_hosts) == 0 else "red bold"
+            self.console.log(f"[{color}]Wave {name} finished in {et} sec, {len(failed_hosts)}/{len(members)} hosts failed")
+            if len(failed_hosts) > 0:
+                self.console.log(f"[{color} dim]{', '.join(failed_hosts)}")
+
+            threshold = 0 if name == "canary" else self.max_failure_rate
+            if failure_rate > threshold:
+                skipped_waves = list(waves.keys())[i+1:]
+                self.console.log(f"[red bold]Failure rate {round(failure_rate, 2)} exceeded {threshold}. Rollout stopped.")
+                if len(skipped_waves) > 0:
+                    self.console.log(f"[red bold dim]Skipped waves: {', '.join(skipped_waves)}")
+                break
+
+        for name, n_hosts, n_failed, et in report:
+            self.console.log(f"[yellow dim]{name:<24} {n_hosts:>4} hosts {n_failed:>4} failed {et:>8} sec")
+
+        return self.merge_stats(runs)
+
+
+    ## Move the snapshot files of this deploy into the snapshot store, see 'tn4 snapshot' to restore them
+    def archive_snapshot(self):
+        with self.console.status(f"[green]Archiving snapshots..."):
+            start_at = time.time()
+            manifest = self.store.archive(self.snapshot_basedir)
+
+            et = round(time.time() - start_at, 1)
+            self.console.log(f"[yellow]Archiving {len(manifest)} snapshot files finished in {et} sec")
+            self.console.log(f"[yellow dim]Restore them with: tn4 snapshot {os.path.basename(self.snapshot_basedir)}")
+
+
+    ## Save the timing report as JSON in the snapshot dir and show the slowest hosts
+    def report_timing(self):
+        report = self.timing.build()
+        self.timing.dump(f"{self.snapshot_basedir}/timing.json", report)
+
+        stages = list(report["tasks"].keys())
+        table = Table(show_header=True, header_style="bold white")
+        table.box = box.SIMPLE
+
+        table.add_column("Host",   style="bold")
+        table.add_column("Vendor", style="dim")
+        for stage in stages:
+            table.add_column(stage, justify="right")
+        table.add_column("Total", style="bold", justify="right")
+
+        for host, timing in self.timing.slowest(report, self.timing_top):
+            cols = [ str(round(timing["stages"][s], 1)) if s in timing["stages"] else "-" for s in stages ]
+            table.add_row(host, str(timing["vendor"]), *cols, str(round(timing["total"], 1)))
+
+        self.console.log(f"[yellow]Slowest {self.timing_top} hosts (sec), see {self.snapshot_basedir}/timing.json for details")
+        self.console.print(table)
 
 
     def exec(self):
         ok = self.fetch_inventory(
             *self.fetch_inventory_opts,
             netbox_url=self.netbox_url, netbox_token=self.netbox_token,
-            use_cache=self.flg_use_cache, debug=self.flg_debug
+            use_cache=self.flg_use_cache, sync_cache=self.flg_sync_cache,
+            cache_format=self.flg_cache_format, debug=self.flg_debug
         )
 
         if not ok:
@@ -65,9 +427,43 @@ class Deploy(CommandBase):
 
         self.append_ansible_common_vars()
 
+        vendors = { h: v["manufacturer"] for h, v in self.inventory["_meta"]["hosts"].items() }
+        self.timing = TimingReport(vendors)
+
+        os.makedirs(self.snapshot_basedir, exist_ok=True)
+
+        if not self.flg_fetch_only:
+            with self.console.status(f"[green]Rendering configs..."):
+                n_hosts = self.prerender()
+                self.console.log(f"[yellow]Rendering configs finished at {self.snapshot_basedir}")
+
+            is_all_hosts = self.inventory["_meta"]["hosts"].keys() == self.nb_inventory["_meta"]["hosts"].keys()
+
+            if n_hosts == 0:
+                self.console.log("[red bold]No hosts to deploy. Aborted.")
+                self.archive_snapshot()
+                return 100
+
+            ledger  = self.load_ledger()
+            digests = self.lookup_submitted_digests()
+
+            if not self.flg_force_all and self.custom_template_path is None:
+                unchanged_hosts = self.exclude_unchanged_hosts(ledger, digests)
+                n_changed_hosts = len(self.inventory["_meta"]["hosts"])
+
+                if len(unchanged_hosts) > 0:
+                    self.console.log(f"[yellow]Skipped {len(unchanged_hosts)} hosts having no changes since the last deploy")
+                    self.console.log(f"[yellow dim]{', '.join(unchanged_hosts)}")
+
+                if n_changed_hosts == 0:
+                    self.console.log("[yellow]No hosts have changes. Use --force-all to deploy them anyway. Bye.")
+                    self.archive_snapshot()
+                    return 0
+
+                self.console.log(f"[yellow]Found {n_changed_hosts} hosts having changes")
+                self.console.log(f"[yellow dim]{', '.join(self.inventory['_meta']['hosts'].keys())}")
+
         run_opts = {
-            "inventory":          self.inventory,
-            "private_data_dir":   self.workdir_path,
             "project_dir":        self.workdir_path,
             "playbook":           self.main_task_path,
             "verbosity":          self.verbosity,
@@ -76,16 +472,9 @@ class Deploy(CommandBase):
             },
         }
 
-        results = None
         annotation = "[red bold](DRYRUN)" if self.flg_dryrun else ""
         start_at = time.time()
 
-        ## workaround: https://github.com/ansible/ansible-runner/issues/702
-        hosts_json = f"{self.inventory_path}/hosts.json"
-        os.path.exists(hosts_json) and os.remove(hosts_json)
-
-        os.makedirs(self.snapshot_basedir, exist_ok=True)
-
         if self.custom_template_path is not None:
             self.console.log(f"[yellow]Ready to provisioning Titanet4 with Ansible Runner using custom template... {annotation}")
 
@@ -95,11 +484,24 @@ class Deploy(CommandBase):
         else:
             self.console.log(f"[yellow]Ready to provisioning Titanet4 with Ansible Runner... {annotation}")
 
-        print("\n"*0)  # terminal margin
-        results = run(**run_opts)
-        print("\n"*1)  # terminal margin
+        if self.flg_waves:
+            stats = self.run_waves(run_opts)
+        else:
+            stats = self.run_ansible(run_opts, self.inventory)
 
         et = round(time.time() - start_at, 1)
         self.console.log(f"[yellow]Ansible Runner finished in {et} sec.")
 
+        ## the snapshot dir is the output dir of 'tn4 config --remote-fetch', left with the fetched configs only
+        if not self.flg_fetch_only:
+            self.report_timing()
+
+        if not self.flg_fetch_only and not self.flg_dryrun:
+            self.update_ledger(ledger, digests, stats)
+            self.save_netbox_snapshot(stats, is_all_hosts)
+
+        ## configs fetched by 'tn4 config --remote-fetch' are left as they are in the given directory
+        if not self.flg_fetch_only:
+            self.archive_snapshot()
+
         return 0
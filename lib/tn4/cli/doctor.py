@@ -37,7 +37,10 @@ class Doctor(CommandBase):
         self.flg_diagnose_only = args.diagnose_only
         self.flg_force_repair   = args.force_repair
         self.flg_use_cache      = args.use_cache
+        self.flg_sync_cache     = args.sync_cache
+        self.flg_cache_format   = args.cache_format
         self.flg_debug          = args.debug
+        self.jobs               = 1 if args.jobs is None else args.jobs  # worker processes pay off on large runs only
 
         self.fetch_inventory_opts = [
             args.hosts,   args.no_hosts,
@@ -179,7 +182,8 @@ class Doctor(CommandBase):
     def exec(self):
         ok = self.fetch_inventory(
             netbox_url=self.netbox_url, netbox_token=self.netbox_token,
-            use_cache=self.flg_use_cache, debug=self.flg_debug
+            use_cache=self.flg_use_cache, sync_cache=self.flg_sync_cache,
+            cache_format=self.flg_cache_format, debug=self.flg_debug
         )
 
         if not ok:
@@ -188,6 +192,7 @@ class Doctor(CommandBase):
         self.cap = Capability(self.ctx, self.nb.cli)
 
         hosts  = self.filter_hosts(*self.fetch_inventory_opts)
+        is_filtered = any(self.fetch_inventory_opts)
 
         if len(hosts) > 0:
             self.console.log(f"[yellow]Repairing targets are the following {len(hosts)} hosts")
@@ -195,41 +200,17 @@ class Doctor(CommandBase):
 
         with self.console.status(f"[green]Scanning NetBox and checking consistency..."):
 
-            i, n = 1, 9
-            self.cap.diagnose.check_exclusive_tag_conflict()
-            self.console.log(f"[yellow]Checked tag-to-tag confliction [dim]({i} of {n})")
+            rules = [ rule for rule in self.cap.diagnose.engine.rules if rule.message is not None ]
+            n = len(rules)
 
-            i += 1
-            self.cap.diagnose.check_and_clear_incomplete_interfaces()
-            self.console.log(f"[yellow]Checked incomplete interfaces [dim]({i} of {n})")
+            def log_rule(rule):
+                if rule.message is not None:
+                    self.console.log(f"[yellow]{rule.message} [dim]({rules.index(rule)+1} of {n})")
 
-            i += 1
-            self.cap.diagnose.check_and_clear_obsoleted_interfaces()
-            self.console.log(f"[yellow]Checked obsoleted interfaces [dim]({i} of {n})")
+            self.cap.diagnose.run(hostnames=hosts if is_filtered else None, callback=log_rule, jobs=self.jobs)
 
-            i += 1
-            self.cap.diagnose.check_wifi_tag_consistency()
-            self.console.log(f"[yellow]Checked Wi-Fi tag consistency [dim]({i} of {n})")
-
-            i += 1
-            self.cap.diagnose.check_hosting_tag_consistency()
-            self.console.log(f"[yellow]Checked Hosting tag consistency [dim]({i} of {n})")
-
-            i += 1
-            self.cap.diagnose.check_vlan_group_consistency()
-            self.console.log(f"[yellow]Checked VLAN group consistency [dim]({i} of {n})")
-
-            i += 1
-            self.cap.diagnose.check_and_remove_empty_irb()
-            self.console.log(f"[yellow]Checked irb status [dim]({i} of {n})")
-
-            i += 1
-            self.cap.diagnose.check_edge_core_consistency()
-            self.console.log(f"[yellow]Checked Core/Edge consistency [dim]({i} of {n})")
-
-            i += 1
-            self.cap.diagnose.check_master_backup_tag_consistency()
-            self.console.log(f"[yellow]Checked Master/Backup consistency [dim]({i} of {n})")
+            if is_filtered:
+                self.console.log(f"[yellow dim]Diagnosed {len(self.cap.diagnose.scope)} hosts including dependencies")
 
         kartes = self.cap.diagnose.summarize()
         kartes = self.show_karte_and_ask(*kartes, target_hosts=hosts,
@@ -0,0 +1,35 @@
+import os
+
+from tn4.cli.base import CommandBase
+from tn4.helper.store import SnapshotStore
+
+
+class Snapshot(CommandBase):
+    def __init__(self, args):
+        self.run_name = args.run
+        self.outdir   = args.outdir
+        self.store    = SnapshotStore(f"{self.workdir_path}/project/snapshots")
+
+
+    def list_runs(self):
+        for run_dir in self.store.runs():
+            manifest = self.store.load_manifest(run_dir)
+            n_files = "-" if manifest is None else len(manifest)
+            self.console.log(f"[yellow]{os.path.basename(run_dir)}[/yellow] [dim]{n_files} files")
+
+
+    def exec(self):
+        if self.run_name is None:
+            self.list_runs()
+            return 0
+
+        run_dir = os.path.join(self.store.basedir, os.path.basename(os.path.normpath(self.run_name)))
+        if self.store.load_manifest(run_dir) is None:
+            self.console.log(f"[red bold]No snapshot manifest found in {run_dir}. Aborted.")
+            return 100
+
+        outdir = run_dir if self.outdir is None else self.outdir
+        paths = self.store.materialize(run_dir, outdir)
+
+        self.console.log(f"[yellow]Restored {len(paths)} snapshot files at {outdir}")
+        return 0
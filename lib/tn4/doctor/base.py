@@ -2,29 +2,68 @@ from functools import reduce
 import operator
 
 
+## NOTE:
+## Inverted indexes (value -> object keys) are built once for the indexed keys of each class,
+## and AND queries are answered by intersecting them. Other keys are indexed on the first query.
 class NetBoxObjectBase:
+    indexed_keys = [ ["name"], ["tags"] ]
+
     def __init__(self, nb_objs):
         self.all = nb_objs
+        self.objs = dict(self.items())
+        self.positions = { key: i for i, key in enumerate(self.objs.keys()) }
+        self.indexes = {}
 
+        for keylst in self.indexed_keys:
+            self.lookup_index(keylst)
 
-    def with_key(self, keylst, *values):
-        matched = []
-        matched_ids = []
 
-        for obj in self.all.values():
-            obj_values = reduce(operator.getitem, keylst, obj)
+    ## Return pairs of the object key (dict key or list position) and the object
+    def items(self):
+        if type(self.all) == dict:
+            return list(self.all.items())
+        return list(enumerate(self.all))
+
+
+    def lookup_index(self, keylst):
+        path = tuple(keylst)
+
+        if path not in self.indexes:
+            index = {}
+
+            for key, obj in self.objs.items():
+                try:
+                    obj_values = reduce(operator.getitem, keylst, obj)
+                except (KeyError, TypeError):
+                    continue  # unresolvable key, eg. the VLAN having no group
+
+                if obj_values is None:
+                    obj_values = []
+
+                if type(obj_values) is not list:
+                    obj_values = [ obj_values ]
+
+                for value in obj_values:
+                    index.setdefault(value, set()).add(key)
 
-            if obj_values is None:
-                obj_values = []
+            self.indexes[path] = index
 
-            if type(obj_values) is not list:
-                obj_values = [ obj_values ]
+        return self.indexes[path]
 
-            if obj["id"] not in matched_ids:
-                if len(set(values) - set(obj_values)) == 0:
-                    matched.append(obj)  # AND
 
-        return matched
+    ## Return the keys of the objects having all the values, in the original order
+    def lookup_keys(self, keylst, *values):
+        if len(values) == 0:
+            return list(self.objs.keys())  # early return
+
+        index = self.lookup_index(keylst)
+        keys = set.intersection(*[ index.get(value, set()) for value in values ])  # AND
+
+        return sorted(keys, key=self.positions.get)
+
+
+    def with_key(self, keylst, *values):
+        return [ self.objs[key] for key in self.lookup_keys(keylst, *values) ]
 
 
     def with_names(self, *names):
@@ -36,6 +75,8 @@ class NetBoxObjectBase:
 
 
 class Vlans(NetBoxObjectBase):
+    indexed_keys = [ *NetBoxObjectBase.indexed_keys, ["vid"], ["group", "slug"] ]
+
     def __init__(self, nb_objs):
         super().__init__(nb_objs)
 
@@ -64,6 +105,8 @@ class Vlans(NetBoxObjectBase):
 
 
 class Devices(NetBoxObjectBase):
+    indexed_keys = [ *NetBoxObjectBase.indexed_keys, ["site", "slug"] ]
+
     def __init__(self, nb_objs):
         super().__init__(nb_objs)
 
@@ -88,3 +131,12 @@ class Interfaces(NetBoxObjectBase):
     def __init__(self, nb_objs):
         super().__init__(nb_objs)
 
+
+    ## Interfaces are grouped by hostname, so they are keyed by hostname and interface name
+    def items(self):
+        return [
+            ((hostname, ifname), interface)
+            for hostname, device_interfaces in self.all.items()
+            for ifname, interface in device_interfaces.items()
+        ]
+
@@ -1,7 +1,6 @@
-from copy import deepcopy
-from functools import reduce
+from concurrent.futures import ProcessPoolExecutor
 from pprint import pprint
-import operator
+from types import SimpleNamespace
 
 from tn4.netbox.slug import Slug
 from tn4.doctor.cv import Condition as Cond
@@ -9,9 +8,39 @@ from tn4.doctor.cv import ConditionalValue as CV
 from tn4.doctor.base import Vlans, Devices, Interfaces
 from tn4.doctor.state import DeviceState, InterfaceState
 from tn4.doctor.karte import InterfaceCondition, KarteType, Karte, Annotation
+from tn4.doctor.rule import Rule, RuleEngine
+
+
+## VLANs and devices shared by all tasks, set by init_worker() once per worker process
+worker_ctx = None
+
+
+def init_worker(vlans, devices_by_hostname):
+    global worker_ctx
+    worker_ctx = SimpleNamespace(vlans=vlans, devices_by_hostname=devices_by_hostname)
+
+
+## Check the rules of the first pass on the interfaces of the devices, see Diagnose.run_in_parallel()
+def check_local_rules(interfaces):
+    ctx = SimpleNamespace(vlans=worker_ctx.vlans, devices_by_hostname=worker_ctx.devices_by_hostname,
+                          interfaces=interfaces)
+    return Diagnose(ctx).run_local()
 
 
 class Diagnose():
+    exclusive_tags = {
+        Slug.Tag.CoreMaster, Slug.Tag.CoreOokayamaMaster, Slug.Tag.CoreSuzukakeMaster,
+        Slug.Tag.CoreBackup, Slug.Tag.CoreOokayamaBackup, Slug.Tag.CoreSuzukakeBackup,
+        Slug.Tag.Wifi, Slug.Tag.Hosting,
+    }
+
+    ## Backup tags and their master tags
+    backup_to_master_tags = {
+        Slug.Tag.CoreBackup:         Slug.Tag.CoreMaster,
+        Slug.Tag.CoreOokayamaBackup: Slug.Tag.CoreOokayamaMaster,
+        Slug.Tag.CoreSuzukakeBackup: Slug.Tag.CoreSuzukakeMaster,
+    }
+
     def __init__(self, ctx):
         self.nb_vlans      = Vlans(ctx.vlans)
         self.nb_devices    = Devices(ctx.devices_by_hostname)
@@ -21,6 +50,10 @@ class Diagnose():
         self.interface_annotations = {}
         self.interface_conditions = {}
         self.is_manual_repair_interface = {}  # set true to skip remaining consistency check
+        self.interface_states = {}            # built once per interface, shared by all rules
+        self.scope = None                     # hostnames diagnosed, or None for all
+        self.folded_conditions = {}           # sum of the conditions given so far, see add_condition()
+        self.desired_states = {}              # desired states built from the folded conditions
 
         for hostname, device_interfaces in self.nb_interfaces.all.items():
             self.device_annotations[hostname] = []
@@ -29,6 +62,251 @@ class Diagnose():
                 self.interface_annotations.setdefault(hostname, {})[ifname] = []
                 self.is_manual_repair_interface.setdefault(hostname, {})[ifname] = False
 
+        self.engine = RuleEngine()
+        self.register_rules()
+
+
+    def register_rules(self):
+        core_edge = [ Slug.Role.CoreSW, Slug.Role.EdgeSW ]
+        edge      = [ Slug.Role.EdgeSW ]
+        core      = [ Slug.Role.CoreSW ]
+
+        ## rules checking each interface by itself
+        self.engine.register(Rule("exclusive_tag", core_edge, self.check_exclusive_tag_conflict,
+                                  message="Checked tag-to-tag confliction"))
+        self.engine.register(Rule("incomplete", core_edge, self.check_and_clear_incomplete_interfaces,
+                                  message="Checked incomplete interfaces"))
+        self.engine.register(Rule("obsoleted", core_edge, self.check_and_clear_obsoleted_interfaces,
+                                  message="Checked obsoleted interfaces"))
+        self.engine.register(Rule("wifi_tag", core_edge, self.check_wifi_tag_consistency,
+                                  message="Checked Wi-Fi tag consistency"))
+        self.engine.register(Rule("hosting_tag", edge, self.check_hosting_tag_consistency,
+                                  message="Checked Hosting tag consistency"))
+        self.engine.register(Rule("vlan_group", core_edge, self.check_vlan_group_consistency,
+                                  message="Checked VLAN group consistency"))
+        self.engine.register(Rule("empty_irb", core_edge, self.check_and_remove_empty_irb,
+                                  message="Checked irb status"))
+
+        ## rules reading the results of the other devices
+        self.engine.register(Rule("edge_uplinks", edge, self.collect_edge_uplink_oids))
+        self.engine.register(Rule("edge_core", core, self.check_edge_core_consistency, needs=["edge_uplinks"],
+                                  finish=self.check_neglected_edges, message="Checked Core/Edge consistency"))
+        self.engine.register(Rule("master_states", core, self.collect_master_states))
+        self.engine.register(Rule("master_backup", core, self.check_master_backup_tag_consistency,
+                                  needs=["master_states"], message="Checked Master/Backup consistency"))
+
+        self.wifi_vlan_oids = {
+            "O1": (self.nb_vlans.with_tags(Slug.Tag.WifiMgmtVlanOokayama1).oids,
+                   self.nb_vlans.with_tags(Slug.Tag.Wifi, Slug.Tag.VlanOokayama).oids),
+            "O2": (self.nb_vlans.with_tags(Slug.Tag.WifiMgmtVlanOokayama2).oids,
+                   self.nb_vlans.with_tags(Slug.Tag.Wifi, Slug.Tag.VlanOokayama).oids),
+            "S":  (self.nb_vlans.with_tags(Slug.Tag.WifiMgmtVlanSuzukake).oids,
+                   self.nb_vlans.with_tags(Slug.Tag.Wifi, Slug.Tag.VlanSuzukake).oids),
+        }
+
+        self.hosting_oids = self.nb_vlans.with_tags(Slug.Tag.Hosting).oids
+
+        self.titanet_oids = self.nb_vlans.with_groups(Slug.VLANGroup.Titanet).oids
+        self.titanet_oids.append(None)
+
+        self.uplink_oids = {}
+        self.downlink_edges = set()
+
+        self.desired_backup   = {}
+        self.desired_backup_o = {}
+        self.desired_backup_s = {}
+
+
+    def lookup_role(self, hostname):
+        return self.nb_devices.all[hostname]["role"]
+
+
+    def lookup_state(self, hostname, ifname):
+        states = self.interface_states.setdefault(hostname, {})
+        if ifname not in states:
+            states[ifname] = InterfaceState(self.nb_interfaces.all[hostname][ifname])
+        return states[ifname]
+
+
+    def has_exclusive_tag_conflict(self, tags):
+        return len(self.exclusive_tags & set(tags)) > 1
+
+
+    ## Return the given hostnames and the hostnames their rules depend on
+    ##  - Core SW: Edge SWs described on its downlinks (Core/Edge consistency)
+    ##  - Core SW having backup interfaces: Core SWs having the master interfaces (Master/Backup consistency)
+    ## NOTE:
+    ## The dependencies are closed, since the master Core SWs also depend on their downlink Edge SWs.
+    def lookup_dependencies(self, hostnames):
+        master_hostnames = {}
+        for master_tag in self.backup_to_master_tags.values():
+            keys = self.nb_interfaces.lookup_keys(["tags"], master_tag)
+            master_hostnames[master_tag] = { hostname for hostname, _ in keys }
+
+        scope   = { hostname for hostname in hostnames if hostname in self.nb_interfaces.all }
+        pending = list(scope)
+
+        while pending:
+            hostname = pending.pop()
+            if self.lookup_role(hostname) != Slug.Role.CoreSW:
+                continue
+
+            dependencies = set()
+
+            for ifname, interface in self.nb_interfaces.all[hostname].items():
+                if Slug.Tag.CoreDownstream in interface["tags"] and interface["description"] in self.nb_interfaces.all:
+                    dependencies.add(interface["description"])
+
+                for backup_tag, master_tag in self.backup_to_master_tags.items():
+                    if backup_tag in interface["tags"]:
+                        dependencies |= master_hostnames[master_tag]
+
+            for dependency in dependencies - scope:
+                scope.add(dependency)
+                pending.append(dependency)
+
+        return scope
+
+
+    ## Return Edge SWs described on the downlinks of all Core SWs, same as check_edge_core_consistency()
+    def scan_downlink_edges(self):
+        edges = set()
+
+        for hostname, ifname in self.nb_interfaces.lookup_keys(["tags"], Slug.Tag.CoreDownstream):
+            interface = self.nb_interfaces.all[hostname][ifname]
+
+            if self.lookup_role(hostname) != Slug.Role.CoreSW:
+                continue
+
+            if self.has_exclusive_tag_conflict(interface["tags"]):
+                continue
+
+            edges.add(InterfaceState(interface).description)
+
+        return edges
+
+
+    def lookup_scoped_interfaces(self):
+        if self.scope is None:
+            return self.nb_interfaces.all  # early return
+
+        return { h: interfaces for h, interfaces in self.nb_interfaces.all.items() if h in self.scope }
+
+
+    ## Check the rules of the first pass and return their results
+    ## NOTE:
+    ## The first pass consists of the rules reading the interface itself only, and the edge uplink collection
+    ## which reads the own device only. Their results are small enough to be sent back from the worker processes.
+    def run_local(self):
+        interfaces = self.nb_interfaces.all
+        self.uplink_oids = { h: set() for h in interfaces.keys() if self.lookup_role(h) == Slug.Role.EdgeSW }
+
+        self.engine.run(interfaces, self.lookup_role, self.lookup_state, last_pass=0)
+
+        return {
+            "conditions":  self.interface_conditions,
+            "annotations": self.interface_annotations,
+            "manual":      self.is_manual_repair_interface,
+            "uplink_oids": self.uplink_oids,
+        }
+
+
+    def merge_local(self, results):
+        for hostname, device_interfaces in results["conditions"].items():
+            for ifname, conditions in device_interfaces.items():
+                for condition in conditions:
+                    self.add_condition(hostname, ifname, condition)
+
+                self.interface_annotations[hostname][ifname].extend(results["annotations"][hostname][ifname])
+                self.is_manual_repair_interface[hostname][ifname] = results["manual"][hostname][ifname]
+
+        for hostname, oids in results["uplink_oids"].items():
+            self.uplink_oids[hostname] |= oids
+
+
+    ## Check the rules of the first pass on the worker processes, each of them takes a chunk of devices
+    ## NOTE:
+    ## Conditions are added in the same order as the serial run, so the kartes are the same.
+    def run_in_parallel(self, interfaces, jobs, callback=None):
+        hostnames = list(interfaces.keys())
+        n_chunks  = min(len(hostnames), jobs * 4)
+        chunks    = [ { h: interfaces[h] for h in hostnames[i::n_chunks] } for i in range(n_chunks) ]
+
+        initargs = (self.nb_vlans.all, self.nb_devices.all)
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=initargs) as executor:
+            for results in executor.map(check_local_rules, chunks):
+                self.merge_local(results)
+
+        for rule in self.engine.plan()[0]:
+            if rule.finish is not None:
+                rule.finish()
+            if callback is not None:
+                callback(rule)
+
+
+    ## Check all consistency rules, callback is called with each rule when it finished
+    ##  - hostnames: target hosts, the rules are checked on them and their dependencies only. None for all
+    ##  - jobs:      number of worker processes checking the rules of the first pass, or 1 for the serial run
+    ## NOTE:
+    ## Whether the Edge SWs are neglected depends on all Core SWs,
+    ## so the downlinks of the Core SWs out of the scope are scanned without checking the rules.
+    def run(self, hostnames=None, callback=None, jobs=1):
+        if hostnames is not None:
+            self.scope = self.lookup_dependencies(hostnames)
+
+        interfaces = self.lookup_scoped_interfaces()
+        self.uplink_oids = { h: set() for h in interfaces.keys() if self.lookup_role(h) == Slug.Role.EdgeSW }
+
+        if self.scope is not None:
+            self.downlink_edges |= self.scan_downlink_edges()
+
+        if jobs > 1 and len(interfaces) > 1:
+            self.run_in_parallel(interfaces, jobs, callback)
+            self.engine.run(interfaces, self.lookup_role, self.lookup_state, callback=callback, first_pass=1)
+        else:
+            self.engine.run(interfaces, self.lookup_role, self.lookup_state, callback=callback)
+
+
+    ## NOTE:
+    ## Conditions are folded incrementally, which is the same as reduce(operator.add, conditions),
+    ## and the desired state is built again only after a new condition is added to the interface.
+    def add_condition(self, hostname, ifname, condition):
+        key = (hostname, ifname)
+
+        self.interface_conditions[hostname][ifname].append(condition)
+        self.desired_states.pop(key, None)
+
+        if key in self.folded_conditions:
+            self.folded_conditions[key] = self.folded_conditions[key] + condition
+        else:
+            self.folded_conditions[key] = condition
+
+
+    def lookup_folded_condition(self, hostname, ifname):
+        return self.folded_conditions.get((hostname, ifname))
+
+
+    ## Return the desired state of the conditions given so far and whether it is buildable
+    ## NOTE:
+    ## The desired state is shared by the callers, who must not modify it but copy().
+    def lookup_desired(self, hostname, ifname, current):
+        key = (hostname, ifname)
+
+        if key not in self.desired_states:
+            condition = self.lookup_folded_condition(hostname, ifname)
+            self.desired_states[key] = self.__build_desired(current, condition)
+
+        return self.desired_states[key]
+
+
+    ## Return the state after applying the conditions given so far, or None if they conflict
+    def lookup_desired_so_far(self, hostname, ifname, current):
+        if len(self.interface_conditions[hostname][ifname]) == 0:
+            return current  # early return
+
+        desired, ok = self.lookup_desired(hostname, ifname, current)
+        return desired if ok else None
+
 
     def __build_desired(self, current, condition):
         is_ok = Cond.CONFLICT not in [ condition.is_enabled.condition,
@@ -42,7 +320,7 @@ class Diagnose():
         if not is_ok:
             return None, False
 
-        desired = deepcopy(current)
+        desired = current.copy()
 
         desired.is_enabled     = condition.is_enabled.to_value(current.is_enabled, value_type=bool)
         desired.description    = condition.description.to_value(current.description, value_type=str)
@@ -79,7 +357,7 @@ class Diagnose():
         has_annotation = lambda h, i: h in self.interface_annotations and i in self.interface_annotations[h]
         has_condition  = lambda h, i: h in self.interface_conditions and i in self.interface_conditions[h]
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
+        for hostname, device_interfaces in self.lookup_scoped_interfaces().items():
 
             if len(self.device_annotations[hostname]) > 0:
                 kartes.append(Karte(
@@ -97,13 +375,13 @@ class Diagnose():
                 if not has_condition(hostname, ifname):
                     continue
 
-                current    = InterfaceState(self.nb_interfaces.all[hostname][ifname])
+                current    = self.lookup_state(hostname, ifname)
                 conditions = self.interface_conditions[hostname][ifname]
 
                 if len(conditions) == 0:
                     if has_annotation(hostname, ifname):
                         kartes.append(Karte(
-                            karte_type=karte_type,
+                            karte_type=KarteType.WARN,
                             hostname=hostname,
                             ifname=ifname,
                             current=current,
@@ -116,8 +394,7 @@ class Diagnose():
 
                 arguments = self.__list_interface_violations(current, conditions)
 
-                condition   = reduce(operator.add, conditions)
-                desired, ok = self.__build_desired(current, condition)
+                desired, ok = self.lookup_desired(hostname, ifname, current)
                 delete      = False
                 skip        = False
 
@@ -163,410 +440,281 @@ class Diagnose():
         return kartes
 
 
-    def check_exclusive_tag_conflict(self):
-        exclusive_tags = set([
-            Slug.Tag.CoreMaster, Slug.Tag.CoreOokayamaMaster, Slug.Tag.CoreSuzukakeMaster,
-            Slug.Tag.CoreBackup, Slug.Tag.CoreOokayamaBackup, Slug.Tag.CoreSuzukakeBackup,
-            Slug.Tag.Wifi, Slug.Tag.Hosting,
-        ])
+    def check_exclusive_tag_conflict(self, hostname, ifname, current):
+        if self.has_exclusive_tag_conflict(current.tags):
+            self.interface_annotations[hostname][ifname].extend([
+                Annotation(message=f"MCLAG/Wi-Fi/Hosting tags are exclusive", severity=3),
+                Annotation(message="Manual repair needed"),
+            ])
+            self.is_manual_repair_interface[hostname][ifname] = True
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
 
-            ## skip if the device is not Core SW or Edge SW
-            if self.nb_devices.all[hostname]["role"] not in [ Slug.Role.CoreSW, Slug.Role.EdgeSW ]:
-                continue
-
-            for ifname, interface in device_interfaces.items():
-                current       = InterfaceState(interface)
-                current_tags  = set(current.tags)
-                attached_tags = exclusive_tags & current_tags
-
-                if len(attached_tags) > 1:
-                    self.interface_annotations[hostname][ifname].extend([
-                        Annotation(message=f"MCLAG/Wi-Fi/Hosting tags are exclusive", severity=3),
-                        Annotation(message="Manual repair needed"),
-                    ])
-                    self.is_manual_repair_interface[hostname][ifname] = True
-
-
-    def check_and_clear_incomplete_interfaces(self):
+    def check_and_clear_incomplete_interfaces(self, hostname, ifname, current):
         has_empty_vlan = lambda s: s.tagged_oids is None and s.untagged_oid is None
-        has_empty_desc = lambda s: s.description in [ None, '' ]
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
+        condition = InterfaceCondition("Incomplete interface")
 
-            ## skip if the device is not Core SW or Edge SW
-            if self.nb_devices.all[hostname]["role"] not in [ Slug.Role.CoreSW, Slug.Role.EdgeSW ]:
-                continue
+        ## skip if the interface needs manual repair
+        if self.is_manual_repair_interface[hostname][ifname]:
+            return
 
-            for ifname, interface in device_interfaces.items():
-                current = InterfaceState(interface)
-                condition = InterfaceCondition("Incomplete interface")
+        ## skip if the interface has 'Keep' tag
+        if current.has_tag(Slug.Tag.Keep):
+            return
 
-                ## skip if the interface needs manual repair
-                if self.is_manual_repair_interface[hostname][ifname]:
-                    continue
+        ## skip if the interface has 'Wi-Fi' tag
+        if current.has_tag(Slug.Tag.Wifi):
+            return
 
-                ## skip if the interface has 'Keep' tag
-                if current.has_tag(Slug.Tag.Keep):
-                    continue
+        ## skip if the interface has 'Hosting' tag
+        if current.has_tag(Slug.Tag.Hosting):
+            return
 
-                ## skip if the interface has 'Wi-Fi' tag
-                if current.has_tag(Slug.Tag.Wifi):
-                    continue
+        ## skip if the interface is a LAG child
+        if current.is_lag_member:
+            return
 
-                ## skip if the interface has 'Hosting' tag
-                if current.has_tag(Slug.Tag.Hosting):
-                    continue
+        is_to_reset  = current.interface_mode is None and current.is_enabled
+        is_to_reset |= current.interface_mode in ["tagged", "access"] and has_empty_vlan(current)
+        is_to_reset |= current.has_tag(Slug.Tag.Obsoleted)
 
-                ## skip if the interface is a LAG child
-                if current.is_lag_member:
-                    continue
+        if not is_to_reset:
+            return
 
-                is_to_reset  = current.interface_mode is None and current.is_enabled
-                is_to_reset |= current.interface_mode in ["tagged", "access"] and has_empty_vlan(current)
-                is_to_reset |= current.has_tag(Slug.Tag.Obsoleted)
+        condition.is_enabled     = CV(False, Cond.IS)
+        condition.description    = CV(None, Cond.IS)
+        condition.tags           = CV(None, Cond.IS)
+        condition.interface_mode = CV(None, Cond.IS)
+        condition.tagged_oids    = CV(None, Cond.IS)
+        condition.untagged_oid   = CV(None, Cond.IS)
 
-                if not is_to_reset:
-                    continue
+        self.add_condition(hostname, ifname, condition)
 
-                condition.is_enabled     = CV(False, Cond.IS)
-                condition.description    = CV(None, Cond.IS)
-                condition.tags           = CV(None, Cond.IS)
-                condition.interface_mode = CV(None, Cond.IS)
-                condition.tagged_oids    = CV(None, Cond.IS)
-                condition.untagged_oid   = CV(None, Cond.IS)
 
-                self.interface_conditions[hostname][ifname].append(condition)
+    def check_and_clear_obsoleted_interfaces(self, hostname, ifname, current):
+        condition = InterfaceCondition("Termination by Obsoleted tag")
 
+        ## skip if the interface needs manual repair
+        if self.is_manual_repair_interface[hostname][ifname]:
+            return
 
-    def check_and_clear_obsoleted_interfaces(self):
-        has_empty_vlan = lambda s: s.tagged_oids is None and s.untagged_oid is None
-        has_empty_desc = lambda s: s.description in [ None, '' ]
+        ## skip if the interface is a LAG child
+        if current.is_lag_member:
+            return
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
+        if not current.has_tag(Slug.Tag.Obsoleted):
+            return
 
-            ## skip if the device is not Core SW or Edge SW
-            if self.nb_devices.all[hostname]["role"] not in [ Slug.Role.CoreSW, Slug.Role.EdgeSW ]:
-                continue
+        condition.is_enabled     = CV(False, Cond.IS, priority=999)
+        condition.description    = CV(None, Cond.IS, priority=999)
+        condition.tags           = CV(None, Cond.IS, priority=999)
+        condition.interface_mode = CV(None, Cond.IS, priority=999)
+        condition.tagged_oids    = CV(None, Cond.IS, priority=999)
+        condition.untagged_oid   = CV(None, Cond.IS, priority=999)
 
-            for ifname, interface in device_interfaces.items():
-                current = InterfaceState(interface)
-                condition = InterfaceCondition("Termination by Obsoleted tag")
+        self.add_condition(hostname, ifname, condition)
 
-                ## skip if the interface needs manual repair
-                if self.is_manual_repair_interface[hostname][ifname]:
-                    continue
 
-                ## skip if the interface is a LAG child
-                if current.is_lag_member:
-                    continue
+    def check_wifi_tag_consistency(self, hostname, ifname, current):
+        condition = InterfaceCondition("By Wi-Fi tag")
 
-                if not current.has_tag(Slug.Tag.Obsoleted):
-                    continue
+        ## skip if the interface needs manual repair
+        if self.is_manual_repair_interface[hostname][ifname]:
+            return
 
-                condition.is_enabled     = CV(False, Cond.IS, priority=999)
-                condition.description    = CV(None, Cond.IS, priority=999)
-                condition.tags           = CV(None, Cond.IS, priority=999)
-                condition.interface_mode = CV(None, Cond.IS, priority=999)
-                condition.tagged_oids    = CV(None, Cond.IS, priority=999)
-                condition.untagged_oid   = CV(None, Cond.IS, priority=999)
+        ## skip if the interface is not for AP
+        if not current.has("is_to_ap"):
+            return
 
-                self.interface_conditions[hostname][ifname].append(condition)
+        cplane_oid, dplane_oids = None, None
+        wifi_area_group = self.nb_devices.all[hostname]["wifi_area_group"]
+        if wifi_area_group in self.wifi_vlan_oids:
+            cplane_oid, dplane_oids = self.wifi_vlan_oids[wifi_area_group]
 
+        ## must be enabled
+        condition.is_enabled = CV(True, Cond.IS, priority=900)
 
-    def check_wifi_tag_consistency(self):
-        wifi_o1_cplane_oid = self.nb_vlans.with_tags(Slug.Tag.WifiMgmtVlanOokayama1).oids
-        wifi_o2_cplane_oid = self.nb_vlans.with_tags(Slug.Tag.WifiMgmtVlanOokayama2).oids
-        wifi_s_cplane_oid  = self.nb_vlans.with_tags(Slug.Tag.WifiMgmtVlanSuzukake).oids
-        wifi_o_dplane_oids = self.nb_vlans.with_tags(Slug.Tag.Wifi, Slug.Tag.VlanOokayama).oids
-        wifi_s_dplane_oids = self.nb_vlans.with_tags(Slug.Tag.Wifi, Slug.Tag.VlanSuzukake).oids
+        ## must be 'tagged' mode
+        condition.interface_mode = CV("tagged", Cond.IS, priority=900)
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
+        ## must have all D-Plane VLANs
+        condition.tagged_oids = CV([*dplane_oids, *cplane_oid], Cond.IS, priority=900)
+        #condition.tagged_oids = CV(dplane_oids, Cond.IS, priority=900)
 
-            ## skip if the device is not Core SW or Edge SW
-            if self.nb_devices.all[hostname]["role"] not in [ Slug.Role.CoreSW, Slug.Role.EdgeSW ]:
-                continue
+        ## must be C-Plane VLAN
+        condition.untagged_oid = CV(cplane_oid, Cond.IS, priority=900)
 
-            device = self.nb_devices.all[hostname]
+        self.add_condition(hostname, ifname, condition)
 
-            cplane_oid, dplane_oids = None, None
-            match device["wifi_area_group"]:
-                case "O1":
-                    cplane_oid, dplane_oids = wifi_o1_cplane_oid, wifi_o_dplane_oids
-                case "O2":
-                    cplane_oid, dplane_oids = wifi_o2_cplane_oid, wifi_o_dplane_oids
-                case "S":
-                    cplane_oid, dplane_oids = wifi_s_cplane_oid,  wifi_s_dplane_oids
 
-            for ifname, interface in device_interfaces.items():
-                current = InterfaceState(interface)
-                condition = InterfaceCondition("By Wi-Fi tag")
+    def check_hosting_tag_consistency(self, hostname, ifname, current):
+        condition = InterfaceCondition("By Hosting tag")
 
-                ## skip if the interface needs manual repair
-                if self.is_manual_repair_interface[hostname][ifname]:
-                    continue
+        ## skip if the interface needs manual repair
+        if self.is_manual_repair_interface[hostname][ifname]:
+            return
 
-                ## skip if the interface is not for AP
-                if not current.has("is_to_ap"):
-                    continue
+        ## skip if the interface is not for hosting
+        if not current.has_tag(Slug.Tag.Hosting):
+            return
 
-                ## must be enabled
-                condition.is_enabled = CV(True, Cond.IS, priority=900)
+        ## must be enabled
+        condition.is_enabled = CV(True, Cond.IS, priority=900)
 
-                ## must be 'tagged' mode
-                condition.interface_mode = CV("tagged", Cond.IS, priority=900)
+        ## must be 'tagged' mode
+        condition.interface_mode = CV("tagged", Cond.IS, priority=900)
 
-                ## must have all D-Plane VLANs
-                condition.tagged_oids = CV([*dplane_oids, *cplane_oid], Cond.IS, priority=900)
-                #condition.tagged_oids = CV(dplane_oids, Cond.IS, priority=900)
+        ## must have all hosting VLANs
+        condition.tagged_oids = CV(self.hosting_oids, Cond.IS, priority=900)
 
-                ## must be C-Plane VLAN
-                condition.untagged_oid = CV(cplane_oid, Cond.IS, priority=900)
+        ## must not have untagged VLAN
+        condition.untagged_oid = CV(None, Cond.IS, priority=900)
 
-                self.interface_conditions[hostname][ifname].append(condition)
+        self.add_condition(hostname, ifname, condition)
 
 
-    def check_hosting_tag_consistency(self):
-        hosting_oids = self.nb_vlans.with_tags(Slug.Tag.Hosting).oids
+    def check_vlan_group_consistency(self, hostname, ifname, current):
+        condition = InterfaceCondition("Outside of Titanet VLANs")
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
+        ## skip if the interface needs manual repair
+        if self.is_manual_repair_interface[hostname][ifname]:
+            return
 
-            ## skip if the device is not Edge SW
-            if self.nb_devices.all[hostname]["role"] != Slug.Role.EdgeSW:
-                continue
+        ## must be included in the VLAN group "Titanet"
+        condition.tagged_oids  = CV(self.titanet_oids, Cond.INCLUDED)
+        condition.untagged_oid = CV(self.titanet_oids, Cond.INCLUDED)
 
-            for ifname, interface in device_interfaces.items():
-                current = InterfaceState(interface)
-                condition = InterfaceCondition("By Hosting tag")
+        self.add_condition(hostname, ifname, condition)
 
-                ## skip if the interface needs manual repair
-                if self.is_manual_repair_interface[hostname][ifname]:
-                    continue
-
-                ## skip if the interface is not for hosting
-                if not current.has_tag(Slug.Tag.Hosting):
-                    continue
-
-                ## must be enabled
-                condition.is_enabled = CV(True, Cond.IS, priority=900)
-
-                ## must be 'tagged' mode
-                condition.interface_mode = CV("tagged", Cond.IS, priority=900)
-
-                ## must have all hosting VLANs
-                condition.tagged_oids = CV(hosting_oids, Cond.IS, priority=900)
-
-                ## must not have untagged VLAN
-                condition.untagged_oid = CV(None, Cond.IS, priority=900)
-
-                self.interface_conditions[hostname][ifname].append(condition)
-
-
-    def check_vlan_group_consistency(self):
-        titanet_oids = self.nb_vlans.with_groups(Slug.VLANGroup.Titanet).oids
-        titanet_oids.append(None)
-
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
-
-            ## skip if the device is not Core SW or Edge SW
-            if self.nb_devices.all[hostname]["role"] not in [ Slug.Role.CoreSW, Slug.Role.EdgeSW ]:
-                continue
-
-            for ifname, interface in device_interfaces.items():
-                condition = InterfaceCondition("Outside of Titanet VLANs")
-
-                ## skip if the interface needs manual repair
-                if self.is_manual_repair_interface[hostname][ifname]:
-                    continue
 
-                ## must be included in the VLAN group "Titanet"
-                condition.tagged_oids  = CV(titanet_oids, Cond.INCLUDED)
-                condition.untagged_oid = CV(titanet_oids, Cond.INCLUDED)
-
-                self.interface_conditions[hostname][ifname].append(condition)
-
-
-    def check_and_remove_empty_irb(self):
+    def check_and_remove_empty_irb(self, hostname, ifname, current):
         has_vlan = lambda s: s.tagged_oids is not None or s.untagged_oid is not None
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
-
-            ## skip if the device is not Core SW or Edge SW
-            if self.nb_devices.all[hostname]["role"] not in [ Slug.Role.CoreSW, Slug.Role.EdgeSW ]:
-                continue
-
-            for ifname, interface in device_interfaces.items():
-                current = InterfaceState(interface)
-                condition = InterfaceCondition("Auto-delete empty irb")
-
-                ## skip if the interface needs manual repair
-                if self.is_manual_repair_interface[hostname][ifname]:
-                    continue
+        condition = InterfaceCondition("Auto-delete empty irb")
 
-                ## skip if the interface has VLANs
-                if ifname[:4] != "irb." or has_vlan(current):
-                    continue
+        ## skip if the interface needs manual repair
+        if self.is_manual_repair_interface[hostname][ifname]:
+            return
 
-                ## remove empty or invalid irb inteface from NetBox
-                condition.delete = CV(True, Cond.IS, priority=100)
+        ## skip if the interface has VLANs
+        if ifname[:4] != "irb." or has_vlan(current):
+            return
 
-                self.interface_conditions[hostname][ifname].append(condition)
+        ## remove empty or invalid irb inteface from NetBox
+        condition.delete = CV(True, Cond.IS, priority=100)
 
+        self.add_condition(hostname, ifname, condition)
 
-    def check_edge_core_consistency(self):
-        titanet_oids = set(self.nb_vlans.with_groups(Slug.VLANGroup.Titanet).oids)
-        uplink_oids  = {}
-        edges        = set()
-
-        ## collect all active VLANs of desired edge state
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
-            if self.nb_devices.all[hostname]["role"] != Slug.Role.EdgeSW:
-                continue
-
-            uplink_oids[hostname] = set()
-
-            for ifname, interface in device_interfaces.items():
-                current     = InterfaceState(interface)
-                conditions  = self.interface_conditions[hostname][ifname]
 
-                if len(conditions) > 0:
-                    condition   = reduce(operator.add, conditions)
-                    desired, ok = self.__build_desired(current, condition)
+    ## collect all active VLANs of desired edge state
+    def collect_edge_uplink_oids(self, hostname, ifname, current):
+        desired = self.lookup_desired_so_far(hostname, ifname, current)
 
-                    if ok:
-                        tagged_oids  = desired.tagged_oids
-                        untagged_oid = desired.untagged_oid
-                    else:
-                        continue
+        if desired is None:
+            return
 
-                else:
-                    tagged_oids  = current.tagged_oids
-                    untagged_oid = current.untagged_oid
+        if desired.tagged_oids is not None:
+            self.uplink_oids[hostname] |= set(desired.tagged_oids)
 
-                if tagged_oids is not None:
-                    uplink_oids[hostname] |= set(tagged_oids)
+        if desired.untagged_oid is not None:
+            self.uplink_oids[hostname] |= { desired.untagged_oid }
 
-                if untagged_oid is not None:
-                    uplink_oids[hostname] |= { untagged_oid }
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
-            if self.nb_devices.all[hostname]["role"] != Slug.Role.CoreSW:
-                continue
+    def check_edge_core_consistency(self, hostname, ifname, current):
+        condition = InterfaceCondition("Core/Edge consistency")
 
-            for ifname, interface in device_interfaces.items():
-                current = InterfaceState(interface)
-                condition = InterfaceCondition("Core/Edge consistency")
+        ## skip if the interface needs manual repair
+        if self.is_manual_repair_interface[hostname][ifname]:
+            return
 
-                ## skip if the interface needs manual repair
-                if self.is_manual_repair_interface[hostname][ifname]:
-                    continue
+        if not current.has_tag(Slug.Tag.CoreDownstream):
+            return
 
-                if not current.has_tag(Slug.Tag.CoreDownstream):
-                    continue
+        edgename = current.description
+        self.downlink_edges.add(edgename)
 
-                edgename = current.description
-                edges.add(edgename)
+        if edgename not in self.uplink_oids:
+            return  # neglected edges
 
-                if edgename not in uplink_oids:
-                    continue  # neglected edges
+        titanet_oids          = set(self.titanet_oids) - { None }
+        invalid_uplink_oids   = self.uplink_oids[edgename] - titanet_oids
+        validated_uplink_oids = self.uplink_oids[edgename] - invalid_uplink_oids
 
-                invalid_uplink_oids   = uplink_oids[edgename] - titanet_oids
-                validated_uplink_oids = uplink_oids[edgename] - invalid_uplink_oids
+        ## pass only in-used VLANs belonging the Titanet Group
+        condition.is_enabled     = CV(True, Cond.IS)
+        condition.interface_mode = CV("tagged", Cond.IS)
+        condition.tagged_oids    = CV(validated_uplink_oids, Cond.IS)
+        condition.untagged_oid   = CV(None, Cond.IS)
 
-                ## pass only in-used VLANs belonging the Titanet Group
-                condition.is_enabled     = CV(True, Cond.IS)
-                condition.interface_mode = CV("tagged", Cond.IS)
-                condition.tagged_oids    = CV(validated_uplink_oids, Cond.IS)
-                condition.untagged_oid   = CV(None, Cond.IS)
+        self.add_condition(hostname, ifname, condition)
 
-                self.interface_conditions[hostname][ifname].append(condition)
 
-        ## edges registered in NB but not appeared in cores' downlinks
-        neglected_edges = set(uplink_oids.keys()) - edges
+    ## edges registered in NB but not appeared in cores' downlinks
+    def check_neglected_edges(self):
+        neglected_edges = set(self.uplink_oids.keys()) - self.downlink_edges
         for edgename in neglected_edges:
             annotation = Annotation("Neglected edge")
             self.device_annotations[edgename].append(annotation)
 
 
-    def check_master_backup_tag_consistency(self):
-        desired_backup = {}
-        desired_backup_o = {}
-        desired_backup_s = {}
+    def collect_master_states(self, hostname, ifname, current):
+        master_state = self.lookup_desired_so_far(hostname, ifname, current)
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
-            if self.nb_devices.all[hostname]["role"] != Slug.Role.CoreSW:
-                continue
+        if master_state is None:
+            master_state = current
 
-            for ifname, interface in device_interfaces.items():
-                current      = InterfaceState(interface)
-                master_state = current
-                conditions   = self.interface_conditions[hostname][ifname]
-
-                if len(conditions) > 0:
-                    condition   = reduce(operator.add, conditions)
-                    desired, ok = self.__build_desired(current, condition)
-
-                    if ok:
-                        master_state = desired
-
-                if master_state.has_tag(Slug.Tag.CoreMaster):
-                    desired_backup[ifname] = deepcopy(master_state)
-                    desired_backup[ifname].tags = set(desired_backup[ifname].tags)
-                    desired_backup[ifname].tags -= { Slug.Tag.CoreMaster }
-                    desired_backup[ifname].tags |= { Slug.Tag.CoreBackup }
-
-                if master_state.has_tag(Slug.Tag.CoreOokayamaMaster):
-                    desired_backup_o[ifname] = deepcopy(master_state)
-                    desired_backup_o[ifname].tags = set(desired_backup_o[ifname].tags)
-                    desired_backup_o[ifname].tags -= { Slug.Tag.CoreOokayamaMaster }
-                    desired_backup_o[ifname].tags |= { Slug.Tag.CoreOokayamaBackup }
-
-                if master_state.has_tag(Slug.Tag.CoreSuzukakeMaster):
-                    desired_backup_s[ifname] = deepcopy(master_state)
-                    desired_backup_s[ifname].tags = set(desired_backup_s[ifname].tags)
-                    desired_backup_s[ifname].tags -= { Slug.Tag.CoreSuzukakeMaster }
-                    desired_backup_s[ifname].tags |= { Slug.Tag.CoreSuzukakeBackup }
+        if master_state.has_tag(Slug.Tag.CoreMaster):
+            self.desired_backup[ifname] = master_state.copy()
+            self.desired_backup[ifname].tags = set(self.desired_backup[ifname].tags)
+            self.desired_backup[ifname].tags -= { Slug.Tag.CoreMaster }
+            self.desired_backup[ifname].tags |= { Slug.Tag.CoreBackup }
 
-        for hostname, device_interfaces in self.nb_interfaces.all.items():
-            if self.nb_devices.all[hostname]["role"] != Slug.Role.CoreSW:
-                continue
+        if master_state.has_tag(Slug.Tag.CoreOokayamaMaster):
+            self.desired_backup_o[ifname] = master_state.copy()
+            self.desired_backup_o[ifname].tags = set(self.desired_backup_o[ifname].tags)
+            self.desired_backup_o[ifname].tags -= { Slug.Tag.CoreOokayamaMaster }
+            self.desired_backup_o[ifname].tags |= { Slug.Tag.CoreOokayamaBackup }
 
-            for ifname, interface in device_interfaces.items():
-                current = InterfaceState(interface)
-                desired = None
+        if master_state.has_tag(Slug.Tag.CoreSuzukakeMaster):
+            self.desired_backup_s[ifname] = master_state.copy()
+            self.desired_backup_s[ifname].tags = set(self.desired_backup_s[ifname].tags)
+            self.desired_backup_s[ifname].tags -= { Slug.Tag.CoreSuzukakeMaster }
+            self.desired_backup_s[ifname].tags |= { Slug.Tag.CoreSuzukakeBackup }
 
-                ## skip if the interface needs manual repair
-                if self.is_manual_repair_interface[hostname][ifname]:
-                    continue
 
-                try:
-                    if current.has_tag(Slug.Tag.CoreBackup):
-                        desired = desired_backup[ifname]
+    def check_master_backup_tag_consistency(self, hostname, ifname, current):
+        desired = None
 
-                    if current.has_tag(Slug.Tag.CoreOokayamaBackup):
-                        desired = desired_backup_o[ifname]
+        ## skip if the interface needs manual repair
+        if self.is_manual_repair_interface[hostname][ifname]:
+            return
 
-                    if current.has_tag(Slug.Tag.CoreSuzukakeBackup):
-                        desired = desired_backup_s[ifname]
+        try:
+            if current.has_tag(Slug.Tag.CoreBackup):
+                desired = self.desired_backup[ifname]
 
-                except KeyError:
-                    annotation = Annotation("Neglected backup")
-                    self.interface_annotations[hostname][ifname].append(annotation)
-                    continue
+            if current.has_tag(Slug.Tag.CoreOokayamaBackup):
+                desired = self.desired_backup_o[ifname]
 
-                if desired is None:
-                    continue
+            if current.has_tag(Slug.Tag.CoreSuzukakeBackup):
+                desired = self.desired_backup_s[ifname]
+
+        except KeyError:
+            annotation = Annotation("Neglected backup")
+            self.interface_annotations[hostname][ifname].append(annotation)
+            return
 
-                condition = InterfaceCondition("Master/Backup consistency")
+        if desired is None:
+            return
 
-                ## copy interface settings but keep original tags
-                condition.is_enabled     = CV(desired.is_enabled, Cond.IS, priority=20)
-                condition.description    = CV(desired.description, Cond.IS, priority=20)
-                condition.interface_mode = CV(desired.interface_mode, Cond.IS, priority=20)
-                condition.tagged_oids    = CV(desired.tagged_oids, Cond.IS, priority=20)
-                condition.untagged_oid   = CV(desired.untagged_oid, Cond.IS, priority=20)
-                condition.tags           = CV(desired.tags, Cond.IS, priority=20)
+        condition = InterfaceCondition("Master/Backup consistency")
 
-                self.interface_conditions[hostname][ifname].append(condition)
+        ## copy interface settings but keep original tags
+        condition.is_enabled     = CV(desired.is_enabled, Cond.IS, priority=20)
+        condition.description    = CV(desired.description, Cond.IS, priority=20)
+        condition.interface_mode = CV(desired.interface_mode, Cond.IS, priority=20)
+        condition.tagged_oids    = CV(desired.tagged_oids, Cond.IS, priority=20)
+        condition.untagged_oid   = CV(desired.untagged_oid, Cond.IS, priority=20)
+        condition.tags           = CV(desired.tags, Cond.IS, priority=20)
 
+        self.add_condition(hostname, ifname, condition)
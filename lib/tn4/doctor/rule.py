@@ -0,0 +1,73 @@
+## Consistency rule checked on each interface of the devices having the given roles
+##  - check:   function called with hostname, ifname and InterfaceState
+##  - needs:   names of the rules which must have finished on all interfaces before this rule
+##  - finish:  function called once after the rule checked all interfaces
+##  - message: logged when the rule finished, or None for the internal rules
+class Rule:
+    def __init__(self, name, roles, check, needs=[], finish=None, message=None):
+        self.name    = name
+        self.roles   = roles
+        self.check   = check
+        self.needs   = needs
+        self.finish  = finish
+        self.message = message
+
+
+## Run the rules in as few traversals of the interfaces as their dependencies allow
+## NOTE:
+## The rules are checked on each interface in the registered order, so that a rule can read what
+## the former rules did to the same interface (e.g. conditions and the manual repair flag) in the same pass.
+## A rule is postponed to the next pass only if it needs the results of a rule on the other interfaces.
+class RuleEngine:
+    def __init__(self):
+        self.rules = []
+
+
+    def register(self, rule):
+        self.rules.append(rule)
+
+
+    ## Return the rules of each pass, in the registered order
+    def plan(self):
+        passes = {}
+        current = 0
+
+        for rule in self.rules:
+            for name in rule.needs:
+                if name not in passes:
+                    raise ValueError(f"Rule '{rule.name}' needs unregistered or later rule '{name}'")
+                current = max(current, passes[name] + 1)
+            passes[rule.name] = current
+
+        plan = [ [] for _ in range(current + 1) ] if len(self.rules) > 0 else []
+        for rule in self.rules:
+            plan[passes[rule.name]].append(rule)
+
+        return plan
+
+
+    ## Check all rules on the interfaces
+    ##  - interfaces: dict of hostname and dict of ifname and any
+    ##  - role_of:    function returning the device role of the hostname
+    ##  - state_of:   function returning InterfaceState of the hostname and ifname
+    ##  - callback:   function called with each rule when it finished
+    ##  - first_pass, last_pass: range of the passes to run, eg. the first pass only on the worker processes
+    def run(self, interfaces, role_of, state_of, callback=None, first_pass=0, last_pass=None):
+        for rules in self.plan()[first_pass:None if last_pass is None else last_pass+1]:
+            for hostname, device_interfaces in interfaces.items():
+                role = role_of(hostname)
+                targets = [ rule for rule in rules if role in rule.roles ]
+
+                if len(targets) == 0:
+                    continue
+
+                for ifname in device_interfaces.keys():
+                    current = state_of(hostname, ifname)
+                    for rule in targets:
+                        rule.check(hostname, ifname, current)
+
+            for rule in rules:
+                if rule.finish is not None:
+                    rule.finish()
+                if callback is not None:
+                    callback(rule)
@@ -1,4 +1,5 @@
 from enum import Flag, auto
+import copy
 
 
 class StateBase:
@@ -78,6 +79,17 @@ class InterfaceState(StateBase):
 
         self.delete = False
 
+
+    ## Shallow copy having its own lists, cheaper than deepcopy() which also copies the NetBox object
+    def copy(self):
+        state = copy.copy(self)
+        for attr in [ "tags", "tagged_oids" ]:
+            value = getattr(state, attr)
+            if isinstance(value, (list, set)):
+                setattr(state, attr, type(value)(value))
+        return state
+
+
     def to_rich_with(self, oid_to_vid, their):
         vlan_t_vids = None
         resolver = lambda *oids: sorted([ oid_to_vid[oid] for oid in oids ])
@@ -0,0 +1,33 @@
+import unittest
+
+from base import Vlans, Interfaces
+
+
+class TestNetBoxObjectBase(unittest.TestCase):
+
+    def setUp(self):
+        self.vlans = Vlans({
+            1: { "id": 1, "vid": 10, "tags": ["wifi", "vlan-o"], "group": { "slug": "titanet" } },
+            2: { "id": 2, "vid": 5,  "tags": ["wifi"],           "group": None },
+            3: { "id": 3, "vid": 7,  "tags": None,               "group": { "slug": "titanet" } },
+        })
+
+    def test_with_tags(self):
+        self.assertEqual(self.vlans.with_tags("wifi").vids, [5, 10])
+        self.assertEqual(self.vlans.with_tags("wifi", "vlan-o").vids, [10])  # AND
+        self.assertEqual(self.vlans.with_tags("wifi", "unknown").vids, [])
+
+    def test_with_groups(self):
+        self.assertEqual(self.vlans.with_groups("titanet").oids, [3, 1])
+
+    def test_with_vids(self):
+        self.assertEqual(self.vlans.with_vids(7).oids, [3])
+        self.assertEqual(self.vlans.with_vids().vids, [5, 7, 10])
+
+    def test_interfaces(self):
+        interfaces = Interfaces({ "minami3": { "ge-0/0/0": { "tags": ["uplink"] }, "ge-0/0/1": { "tags": [] } } })
+        self.assertEqual(interfaces.with_tags("uplink"), [ { "tags": ["uplink"] } ])
+
+
+if __name__ == "__main__":
+    unittest.main()
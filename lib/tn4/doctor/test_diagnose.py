@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+import copy
+import unittest
+
+from tn4.netbox.slug import Slug
+from tn4.doctor.diagnose import Diagnose
+
+
+def vlan(oid, vid, tags=[], group=Slug.VLANGroup.Titanet):
+    return { "id": oid, "vid": vid, "tags": tags, "group": { "slug": group } }
+
+
+def interface(tags=[], tagged=None, untagged=None, mode="tagged", description=""):
+    return {
+        "enabled":         True,
+        "tags":            tags,
+        "tagged_vlanids":  tagged,
+        "untagged_vlanid": untagged,
+        "is_lag_member":   False,
+        "description":     description,
+        "mode":            { "value": mode },
+        "is_to_ap":        False,
+    }
+
+
+class TestDiagnose(unittest.TestCase):
+
+    def setUp(self):
+        vlans = {
+            1: vlan(1, 101, [Slug.Tag.WifiMgmtVlanOokayama1]),
+            2: vlan(2, 102, [Slug.Tag.WifiMgmtVlanOokayama2]),
+            3: vlan(3, 103, [Slug.Tag.WifiMgmtVlanSuzukake]),
+            4: vlan(4, 104),
+            5: vlan(5, 105),
+            6: vlan(6, 106, group="other"),
+        }
+
+        roles = {
+            "core1": Slug.Role.CoreSW, "core2": Slug.Role.CoreSW,
+            "edge1": Slug.Role.EdgeSW, "edge2": Slug.Role.EdgeSW, "edge3": Slug.Role.EdgeSW, "edge4": Slug.Role.EdgeSW,
+        }
+
+        interfaces = {
+            "core1": {
+                "ae1": interface([Slug.Tag.CoreDownstream], [4, 5], description="edge1"),
+                "ae2": interface([Slug.Tag.CoreDownstream], [4], description="edge2"),
+                "ae9": interface([Slug.Tag.CoreMaster], [4]),
+            },
+            "core2": {
+                "ae3": interface([Slug.Tag.CoreDownstream], [6], description="edge3"),
+                "ae9": interface([Slug.Tag.CoreBackup], [5]),
+            },
+            "edge1": {
+                "ge-0/0/0": interface(tagged=[4]),
+                "ge-0/0/1": interface(untagged=5, mode="access"),
+            },
+            "edge2": { "ge-0/0/0": interface(untagged=4, mode="access") },
+            "edge3": { "ge-0/0/0": interface(tagged=[4, 6]) },
+            "edge4": { "ge-0/0/0": interface(untagged=5, mode="access") },  # not on any downlink
+        }
+
+        self.ctx = SimpleNamespace(
+            vlans=vlans,
+            devices_by_hostname={ h: { "name": h, "role": r, "wifi_area_group": None } for h, r in roles.items() },
+            interfaces=interfaces,
+        )
+
+    def diagnose(self, **kwargs):
+        diagnose = Diagnose(copy.deepcopy(self.ctx))
+        diagnose.run(**kwargs)
+        return [ karte.dump() for karte in diagnose.summarize() ]
+
+    def test_lookup_dependencies(self):
+        diagnose = Diagnose(copy.deepcopy(self.ctx))
+        self.assertEqual(diagnose.lookup_dependencies(["edge1"]), { "edge1" })
+        self.assertEqual(diagnose.lookup_dependencies(["core1"]), { "core1", "edge1", "edge2" })
+
+        ## the master Core SW of the backup tag and its downlink Edge SWs
+        self.assertEqual(diagnose.lookup_dependencies(["core2"]), { "core2", "edge3", "core1", "edge1", "edge2" })
+
+    def test_scoped_kartes(self):
+        kartes = self.diagnose()
+
+        for hostnames in [ ["core2"], ["edge2"], ["edge4"] ]:
+            scoped = [ k for k in self.diagnose(hostnames=hostnames) if k["Device"] in hostnames ]
+            self.assertEqual(scoped, [ k for k in kartes if k["Device"] in hostnames ])
+
+        neglected = [ k for k in self.diagnose(hostnames=["edge4"]) if k["Device"] == "edge4" ]
+        self.assertIn({ "Severity": 1, "Message": "Neglected edge" }, neglected[0]["Annotations"])
+
+    def test_parallel_kartes(self):
+        self.assertEqual(self.diagnose(jobs=2), self.diagnose())
+        self.assertEqual(self.diagnose(hostnames=["core2"], jobs=2), self.diagnose(hostnames=["core2"]))
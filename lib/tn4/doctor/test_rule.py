@@ -0,0 +1,45 @@
+import unittest
+
+from rule import Rule, RuleEngine
+
+
+class TestRuleEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.log = []
+        self.engine = RuleEngine()
+        check = lambda name: lambda h, i, s: self.log.append((name, h, i))
+
+        self.engine.register(Rule("a", ["edge", "core"], check("a")))
+        self.engine.register(Rule("b", ["edge"], check("b")))
+        self.engine.register(Rule("c", ["core"], check("c"), needs=["b"]))
+        self.engine.register(Rule("d", ["core"], check("d")))
+        self.engine.register(Rule("e", ["core"], check("e"), needs=["d"]))
+
+    def test_plan(self):
+        plan = [ [ rule.name for rule in rules ] for rules in self.engine.plan() ]
+        self.assertEqual(plan, [ ["a", "b"], ["c", "d"], ["e"] ])
+
+    def test_unknown_dependency(self):
+        self.engine.register(Rule("f", ["core"], None, needs=["g"]))
+        self.assertRaises(ValueError, self.engine.plan)
+
+    def test_run(self):
+        interfaces = { "edge1": { "ge-0/0/0": {}, "ge-0/0/1": {} }, "core1": { "ae0": {} }, "pdu1": { "eth0": {} } }
+        roles      = { "edge1": "edge", "core1": "core", "pdu1": "pdu" }
+        finished   = []
+
+        self.engine.run(interfaces, roles.get, lambda h, i: (h, i), callback=lambda r: finished.append(r.name))
+
+        self.assertEqual(self.log, [
+            ("a", "edge1", "ge-0/0/0"), ("b", "edge1", "ge-0/0/0"),
+            ("a", "edge1", "ge-0/0/1"), ("b", "edge1", "ge-0/0/1"),
+            ("a", "core1", "ae0"),
+            ("c", "core1", "ae0"), ("d", "core1", "ae0"),
+            ("e", "core1", "ae0"),
+        ])
+        self.assertEqual(finished, ["a", "b", "c", "d", "e"])
+
+
+if __name__ == "__main__":
+    unittest.main()
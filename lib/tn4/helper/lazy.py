@@ -0,0 +1,118 @@
+import os
+import re
+
+
+## Dict whose some values are computed on the first read and memoized
+##  - declare():     register a compute function instead of the value
+##  - materialize(): compute the declared values in advance, before exporting the dict as JSON
+## NOTE:
+## Compute functions and their arguments must be picklable (no lambdas), since hostvars are deep-copied.
+## Pending values are invisible to json.dump() and dict(), so materialize() them before passing outside.
+class LazyVars(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.thunks = {}
+        for arg in args:
+            if isinstance(arg, LazyVars):
+                self.thunks |= arg.thunks
+
+
+    def declare(self, key, fn, *args):
+        dict.pop(self, key, None)
+        self.thunks[key] = (fn, args)
+
+
+    def __missing__(self, key):
+        if key not in self.thunks:
+            raise KeyError(key)
+
+        fn, args = self.thunks.pop(key)
+        value = self[key] = fn(*args)
+        return value
+
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self.thunks
+
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+    def pending(self):
+        return list(self.thunks.keys())
+
+
+    def materialize(self, keys=None):
+        for key in self.pending():
+            if keys is None or key in keys:
+                self[key]
+        return self
+
+
+    def copy(self):
+        return LazyVars(self)
+
+
+    def __ior__(self, other):
+        for key in other.keys():
+            self.thunks.pop(key, None)
+        dict.update(self, other)
+
+        if isinstance(other, LazyVars):
+            for key in other.thunks.keys():
+                dict.pop(self, key, None)
+            self.thunks |= other.thunks
+
+        return self
+
+
+    def __or__(self, other):
+        merged = LazyVars(self)
+        merged |= other
+        return merged
+
+
+## Return a new LazyVars having only the given keys, keeping pending values pending
+def pick(src, keys):
+    dst = LazyVars()
+    for key in keys:
+        if isinstance(src, LazyVars) and key in src.thunks:
+            dst.thunks[key] = src.thunks[key]
+        elif key in src:
+            dst[key] = src[key]
+    return dst
+
+
+## Materialize LazyVars in the nested dicts and lists
+##  - keys: names to be materialized, or None for all
+def materialize(obj, keys=None):
+    if isinstance(obj, LazyVars):
+        obj.materialize(keys)
+    if isinstance(obj, dict):
+        for value in obj.values():
+            materialize(value, keys)
+    if isinstance(obj, list):
+        for value in obj:
+            materialize(value, keys)
+    return obj
+
+
+## Return all identifiers appearing in the templates and tasks under the given paths.
+## It is a superset of the variable names actually read, enough to decide what to materialize.
+def referenced_names(*paths):
+    names = set()
+    identifier = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+
+    for path in paths:
+        files = [ path ]
+        if os.path.isdir(path):
+            files = [ os.path.join(d, f) for d, _, fs in os.walk(path) for f in fs ]
+
+        for file in files:
+            if os.path.splitext(file)[1] not in [ ".j2", ".yml", ".yaml" ]:
+                continue
+            with open(file) as fd:
+                names |= set(identifier.findall(fd.read()))
+
+    return names
@@ -0,0 +1,30 @@
+## Manufacturers whose commit is rolled back unless it is confirmed, see --commit-confirm
+confirmed_commit_manufacturers = [ "juniper" ]
+
+
+## Update the ledger of the configs successfully applied in place
+##  - ledger:  dict of hostname and { "sha256", "applied_at" }
+##  - hosts:   dict of hostname and hostvars of the deployed hosts
+##  - digests: dict of hostname and sha256 of the submitted config
+##  - stats:   stats of Ansible Runner, see Deploy.merge_stats()
+## NOTE:
+## Hosts processed and not failed nor unreachable are regarded as committed.
+## Custom templates are not tracked, so the entries of overwritten hosts are dropped to be deployed next time.
+## Commits with 'commit confirmed' are never confirmed by the playbooks and rolled back after the given minutes,
+## so the entries of those hosts are also dropped.
+def update_ledger(ledger, hosts, digests, stats, applied_at, commit_confirm_min=0, is_overwrite=False):
+    failed_hosts = set(stats.get("failures", {}).keys()) | set(stats.get("dark", {}).keys())
+    processed    = stats.get("processed", hosts)
+
+    for host, hostvar in hosts.items():
+        if host in failed_hosts or host not in processed:
+            continue
+
+        is_unconfirmed = commit_confirm_min > 0 and hostvar["manufacturer"] in confirmed_commit_manufacturers
+
+        if is_overwrite or is_unconfirmed:
+            ledger.pop(host, None)
+        else:
+            ledger[host] = { "sha256": digests[host], "applied_at": applied_at }
+
+    return ledger
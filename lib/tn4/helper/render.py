@@ -0,0 +1,175 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from jinja2 import FileSystemBytecodeCache, FileSystemLoader, Environment, meta
+import hashlib
+import json
+import os
+import time
+
+from tn4.helper.lazy import materialize
+
+
+## Compiled templates and names read by them, set by init_worker() once per worker process
+##  - primary key:    manufacturer
+##  - secondary key:  role
+##  - value:          list of jinja2 templates
+templates      = None
+template_names = None
+groups         = None  # Ansible inventory groups and their hostnames, or None not to set the magic variables
+all_hostvars   = None
+
+## Shared environments, one per template directory and rendering option
+environments = {}
+
+
+## NOTE:
+## Compiled templates (including the included ones) are cached on disk by Jinja2,
+## keyed by the template path and the checksum of its source, so edited templates are compiled again.
+## The key does not include the environment options, so the cache directory is split by them.
+def lookup_environment(template_dir, trim_blocks):
+    key = (os.path.abspath(template_dir), trim_blocks)
+
+    if key not in environments:
+        cache_dir = os.path.expanduser("~") + f"/.cache/tn4-player/jinja2/trim_blocks-{str(trim_blocks).lower()}"
+        os.makedirs(cache_dir, exist_ok=True)
+
+        environments[key] = Environment(
+            loader=FileSystemLoader(key[0]),
+            trim_blocks=trim_blocks,
+            bytecode_cache=FileSystemBytecodeCache(cache_dir),
+        )
+
+    return environments[key]
+
+
+def load_templates(template_paths, trim_blocks):
+    loaded = {}
+
+    for manufacturer, roles in template_paths.items():
+        for role, paths in roles.items():
+            for path in paths:
+                e = lookup_environment(os.path.dirname(path), trim_blocks)
+                t = e.get_template(os.path.basename(path))
+                loaded.setdefault(manufacturer, {}).setdefault(role, []).append(t)
+
+    return loaded
+
+
+## Return the hash of the templates and all templates included from them
+## NOTE:
+## If an include is not a constant string, all templates in the directory are hashed instead.
+def template_digest(paths, trim_blocks):
+    h = hashlib.sha256(f"trim_blocks={trim_blocks}".encode())
+
+    for path in paths:
+        e = lookup_environment(os.path.dirname(path), trim_blocks)
+        names, pending = set(), [ os.path.basename(path) ]
+
+        while pending:
+            name = pending.pop()
+            if name in names:
+                continue
+            names.add(name)
+
+            source, _, _ = e.loader.get_source(e, name)
+            for ref in meta.find_referenced_templates(e.parse(source)):
+                if ref is None:
+                    pending.extend(e.list_templates())
+                else:
+                    pending.append(ref)
+
+        for name in sorted(names):
+            source, _, _ = e.loader.get_source(e, name)
+            h.update(f"{path}:{name}\0{source}\0".encode())
+
+    return h.hexdigest()
+
+
+## Return the hash of the hostvars, except the timestamp of the run
+def hostvar_digest(hostvar):
+    normalized = { k: v for k, v in hostvar.items() if k != "datetime" }
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def init_worker(template_paths, trim_blocks, names, inventory_groups=None, hostvars=None):
+    global templates, template_names, groups, all_hostvars
+    templates      = load_templates(template_paths, trim_blocks)
+    template_names = names
+    groups         = inventory_groups
+    all_hostvars   = hostvars
+
+
+## Return the Ansible magic variables of the host, same as the template lookup in the playbooks
+## NOTE:
+## 'hostvars' is only set if the templates read it, not to send all hostvars to each worker.
+def lookup_magic_vars(host):
+    if groups is None:
+        return {}  # early return
+
+    magic_vars = {
+        "inventory_hostname":       host,
+        "inventory_hostname_short": host.split(".")[0],
+        "group_names":              sorted([ g for g, hs in groups.items() if host in hs and g != "all" ]),
+        "groups":                   groups,
+    }
+
+    if all_hostvars is not None:
+        magic_vars["hostvars"] = all_hostvars
+
+    return magic_vars
+
+
+## Render all templates of the host and write them as {outdir}/{host}{suffix}
+##  - return: hostname, list of exception messages of skipped templates and elapsed seconds
+def render_host(outdir, suffix, host, hostvar):
+    config, errors = [], []
+    start_at = time.perf_counter()
+    ignore_empty_lines = lambda s: "\n".join([l for l in s.split("\n") if l != ""])
+
+    materialize(hostvar, template_names)  # lazy hostvars read by the templates
+
+    for template in templates[hostvar["manufacturer"]][hostvar["role"]]:
+        try:
+            raw = template.render(hostvar | lookup_magic_vars(host))
+        except Exception as e:
+            errors.append(str(e))
+        else:
+            config.append(ignore_empty_lines(raw))
+
+    with open(f"{outdir}/{host}{suffix}", "w") as fd:
+        fd.write("\n".join(config))
+
+    return host, errors, time.perf_counter() - start_at
+
+
+## Render hosts in parallel worker processes, or in the current process if jobs is 1
+## NOTE:
+## Each worker compiles the templates by itself once, since compiled templates are not picklable.
+## Results are yielded in the order of hosts either way, so the output is the same as the serial rendering.
+##  - groups: Ansible inventory groups and their hostnames to set the magic variables (eg. group_names), or None
+class Renderer:
+    def __init__(self, template_paths, names, trim_blocks=False, jobs=None, suffix=".cfg", groups=None):
+        self.template_paths = template_paths
+        self.names          = names
+        self.trim_blocks    = trim_blocks
+        self.jobs           = jobs or os.cpu_count() or 1
+        self.suffix         = suffix
+        self.groups         = groups
+
+
+    def render(self, outdir, hosts):
+        hostvars = dict(hosts) if self.groups is not None and "hostvars" in self.names else None
+        initargs = (self.template_paths, self.trim_blocks, self.names, self.groups, hostvars)
+        jobs = min(self.jobs, len(hosts))
+
+        if jobs <= 1:
+            init_worker(*initargs)
+            for host, hostvar in hosts.items():
+                yield render_host(outdir, self.suffix, host, hostvar)
+            return  # early return
+
+        chunksize = max(1, len(hosts) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=initargs) as executor:
+            yield from executor.map(render_host, repeat(outdir), repeat(self.suffix), hosts.keys(), hosts.values(),
+                                    chunksize=chunksize)
@@ -0,0 +1,107 @@
+from glob import glob
+import hashlib
+import json
+import os
+import zlib
+
+from tn4.netbox.cache import atomic_write
+
+
+## Content-addressed store of the snapshot files shared by all runs
+##  - objects/<sha256[:2]>/<sha256[2:]>:  zlib-compressed file contents
+##  - <run dir>/manifest.json:            relative paths of the run's files and their sha256
+## NOTE:
+## Most configs are the same as the ones of the previous run, so only new contents are written.
+## The sha256 is of the raw contents, the same as the digests in the deploy ledger.
+class SnapshotStore:
+    manifest_name = "manifest.json"
+
+    ## Directories under the run dir not archived (Ansible Runner's private data dirs of the shards)
+    excluded_dirs = [ "runner" ]
+
+    def __init__(self, basedir):
+        self.basedir     = basedir
+        self.objects_dir = f"{basedir}/objects"
+
+
+    def lookup_blob_path(self, digest):
+        return f"{self.objects_dir}/{digest[:2]}/{digest[2:]}"
+
+
+    def put(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.lookup_blob_path(digest)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write(path, zlib.compress(data))
+
+        return digest
+
+
+    def get(self, digest):
+        with open(self.lookup_blob_path(digest), "rb") as fd:
+            return zlib.decompress(fd.read())
+
+
+    def load_manifest(self, run_dir):
+        try:
+            with open(f"{run_dir}/{self.manifest_name}") as fd:
+                return json.load(fd)
+        except Exception as e:
+            return None
+
+
+    ## Move the files of the run dir into the store, leaving the manifest only
+    ##  - return: manifest, dict of relative path and sha256
+    def archive(self, run_dir):
+        manifest = self.load_manifest(run_dir) or {}
+
+        for d, dirs, files in os.walk(run_dir):
+            if d == run_dir:
+                dirs[:] = [ x for x in dirs if x not in self.excluded_dirs ]
+
+            for f in files:
+                path = os.path.join(d, f)
+                relpath = os.path.relpath(path, run_dir)
+                if relpath == self.manifest_name or os.path.islink(path):
+                    continue
+
+                with open(path, "rb") as fd:
+                    manifest[relpath] = self.put(fd.read())
+
+        atomic_write(f"{run_dir}/{self.manifest_name}", json.dumps(manifest, indent=4, sort_keys=True).encode())
+
+        for relpath in manifest.keys():
+            path = os.path.join(run_dir, relpath)
+            os.path.exists(path) and os.remove(path)
+
+        for d, _, _ in sorted(os.walk(run_dir), reverse=True):
+            if d != run_dir and len(os.listdir(d)) == 0:
+                os.rmdir(d)
+
+        return manifest
+
+
+    ## Write the files of the run back to the output dir
+    ##  - prefix: relative path prefix of the files to be materialized, or None for all
+    def materialize(self, run_dir, outdir, prefix=None):
+        manifest = self.load_manifest(run_dir) or {}
+        paths = []
+
+        for relpath, digest in sorted(manifest.items()):
+            if prefix is not None and not relpath.startswith(prefix):
+                continue
+
+            path = os.path.join(outdir, relpath)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as fd:
+                fd.write(self.get(digest))
+            paths.append(path)
+
+        return paths
+
+
+    ## Return the run dirs in chronological order
+    def runs(self):
+        return sorted([ d for d in glob(f"{self.basedir}/config.*") if os.path.isdir(d) ])
@@ -0,0 +1,35 @@
+import unittest
+
+from ledger import update_ledger
+
+
+class TestLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.hosts   = { "minami3": { "manufacturer": "juniper" }, "ishikawa": { "manufacturer": "cisco" } }
+        self.digests = { "minami3": "aaa", "ishikawa": "bbb" }
+        self.ledger  = { "minami3": { "sha256": "old", "applied_at": "t0" } }
+
+    def test_committed(self):
+        update_ledger(self.ledger, self.hosts, self.digests, {}, "t1")
+        self.assertEqual(self.ledger["minami3"], { "sha256": "aaa", "applied_at": "t1" })
+        self.assertEqual(self.ledger["ishikawa"], { "sha256": "bbb", "applied_at": "t1" })
+
+    def test_failed(self):
+        update_ledger(self.ledger, self.hosts, self.digests, { "dark": { "minami3": 1 }, "processed": self.hosts }, "t1")
+        self.assertEqual(self.ledger["minami3"], { "sha256": "old", "applied_at": "t0" })
+        self.assertIn("ishikawa", self.ledger)
+
+    def test_commit_confirm(self):
+        ## Juniper hosts roll back unless the commit is confirmed, Cisco hosts do not use commit confirm
+        update_ledger(self.ledger, self.hosts, self.digests, {}, "t1", commit_confirm_min=5)
+        self.assertNotIn("minami3", self.ledger)
+        self.assertEqual(self.ledger["ishikawa"], { "sha256": "bbb", "applied_at": "t1" })
+
+    def test_overwrite(self):
+        update_ledger(self.ledger, self.hosts, self.digests, {}, "t1", is_overwrite=True)
+        self.assertEqual(self.ledger, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from timing import TimingReport, percentile
+
+
+def event(name, host, task, duration):
+    return { "event": name, "event_data": { "host": host, "task": task, "duration": duration } }
+
+
+class TestTiming(unittest.TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile([3, 1, 2], 50), 2)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_report(self):
+        t = TimingReport({ "minami3": "juniper", "ishikawa": "cisco" })
+        t.add("minami3", "render", 0.5)
+
+        self.assertTrue(t.event_handler(event("runner_on_ok", "minami3", "Enable NETCONF", 2.0)))
+        self.assertTrue(t.event_handler(event("runner_on_ok", "minami3", "Provisioning Edge SWs", 30.0)))
+        self.assertTrue(t.event_handler(event("runner_on_failed", "ishikawa", "Provisioning Edge SWs", 10.0)))
+        self.assertTrue(t.event_handler(event("runner_on_start", "ishikawa", "Create pre snapshots", None)))
+        self.assertTrue(t.event_handler({ "event": "playbook_on_stats" }))
+
+        report = t.build()
+        self.assertEqual(report["hosts"]["minami3"]["stages"], { "render": 0.5, "netconf": 2.0, "commit": 30.0 })
+        self.assertEqual(report["hosts"]["minami3"]["total"], 32.5)
+        self.assertEqual(report["tasks"]["commit"]["count"], 2)
+        self.assertEqual(report["tasks"]["commit"]["max"], 30.0)
+        self.assertEqual(report["vendors"]["cisco"]["commit"]["p50"], 10.0)
+        self.assertEqual([ h for h, _ in t.slowest(report, 1) ], [ "minami3" ])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+from threading import Lock
+import json
+
+
+## Return the percentile of the values by the nearest-rank method
+def percentile(values, p):
+    if len(values) == 0:
+        return None  # early return
+
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))  # ceil
+    return ordered[int(rank) - 1]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50":   percentile(values, 50),
+        "p95":   percentile(values, 95),
+        "max":   max(values) if len(values) > 0 else None,
+        "total": round(sum(values), 3),
+    }
+
+
+## Timing report of a deploy built from the events of Ansible Runner
+##  - stages:   task name prefixes and their stage names, others are reported by their task names
+##  - vendors:  dict of hostname and manufacturer
+## NOTE:
+## event_handler() is called from the threads of Ansible Runner instances when running in shards,
+## so the records are guarded by the lock.
+class TimingReport:
+    stages = {
+        "Enable NETCONF":        "netconf",
+        "Create pre snapshots":  "pre_snapshot",
+        "Provisioning":          "commit",
+        "Create post snapshots": "post_snapshot",
+        "Fetch configs":         "fetch",
+    }
+
+    host_events = [ "runner_on_ok", "runner_on_failed", "runner_on_unreachable" ]
+
+    def __init__(self, vendors):
+        self.vendors = vendors
+        self.records = []  # list of (hostname, stage, duration)
+        self.lock    = Lock()
+
+
+    def lookup_stage(self, task):
+        for prefix, stage in self.stages.items():
+            if task.startswith(prefix):
+                return stage
+        return task
+
+
+    def add(self, host, stage, duration):
+        with self.lock:
+            self.records.append((host, stage, duration))
+
+
+    ## Callback of ansible_runner.run(), returns True to keep the event in the artifacts
+    def event_handler(self, event):
+        if event.get("event") in self.host_events:
+            data = event.get("event_data", {})
+            if data.get("duration") is not None:
+                self.add(data["host"], self.lookup_stage(data.get("task", "")), data["duration"])
+        return True
+
+
+    def build(self):
+        hosts, tasks, vendors = {}, {}, {}
+
+        with self.lock:
+            records = list(self.records)
+
+        for host, stage, duration in records:
+            vendor = self.vendors.get(host)
+            h = hosts.setdefault(host, { "vendor": vendor, "stages": {}, "total": 0 })
+            h["stages"][stage] = round(h["stages"].get(stage, 0) + duration, 3)
+            h["total"] = round(h["total"] + duration, 3)
+
+            tasks.setdefault(stage, []).append(duration)
+            vendors.setdefault(vendor, {}).setdefault(stage, []).append(duration)
+
+        return {
+            "hosts":   hosts,
+            "tasks":   { stage: summarize(ds) for stage, ds in tasks.items() },
+            "vendors": {
+                str(vendor): { stage: summarize(ds) for stage, ds in stages.items() }
+                for vendor, stages in vendors.items()
+            },
+        }
+
+
+    ## Return hostnames and their timings, the slowest first
+    def slowest(self, report, n):
+        return sorted(report["hosts"].items(), key=lambda kv: kv[1]["total"], reverse=True)[:n]
+
+
+    def dump(self, path, report):
+        with open(path, "w") as fd:
+            json.dump(report, fd, indent=4, sort_keys=True)
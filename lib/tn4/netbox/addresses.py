@@ -1,4 +1,6 @@
 from tn4.netbox.base import ClientBase
+from tn4.netbox.refs import resolve_all
+from tn4.netbox.slug import Slug
 
 
 class Addresses(ClientBase):
@@ -48,7 +50,7 @@ class Addresses(ClientBase):
 
         addresses = []
 
-        for address in self.all_addresses:
+        for address in ctx.branches.candidates("addresses", cf, self.all_addresses):
             matched = True
             for cf_key in cf.keys():
                 if cf_key not in address["custom_fields"]:
@@ -65,7 +67,34 @@ class Addresses(ClientBase):
 
 
 
-    def fetch_addresses(self, ctx, use_cache=False):
+    ## Return addresses on the given devices and all VRRP addresses,
+    ## since VRRP VIPs are assigned to FHRP groups instead of device interfaces
+    def query_by_devices(self, ctx, device_ids):
+        on_devices, _ = self.query(ctx, self.path, params={ "device_id": device_ids })
+        for_vrrp, _   = self.query(ctx, self.path, params={ "role": Slug.Role.VRRP })
+
+        addresses = {}
+        for address in [ *on_devices, *for_vrrp ]:
+            addresses[address["id"]] = address
+
+        return list(addresses.values())
+
+
+    ## Rewrite the assigned objects embedded in the synced addresses, see ClientBase.sync()
+    def patch_refs(self, ctx, addresses, since):
+        interfaces = self.fetch_changed_refs(ctx, "/dcim/interfaces/", since)
+        devices    = self.fetch_changed_refs(ctx, "/dcim/devices/", since)
+        if interfaces is None or devices is None:
+            return False  # early return
+
+        assigned = [ address for address in addresses if address["assigned_object_type"] == "dcim.interface" ]
+
+        resolve_all(assigned, "assigned_object", interfaces)
+        resolve_all([ address["assigned_object"] for address in assigned ], "device", devices)
+        return True
+
+
+    def fetch_addresses(self, ctx, use_cache=False, sync_cache=False):
         all_addresses = None
 
         if use_cache:
@@ -73,18 +102,34 @@ class Addresses(ClientBase):
                 return self.all_addresses
             all_addresses, _ = self.load(self.path)
 
+        elif sync_cache:
+            all_addresses, _ = self.sync(ctx, self.path, patch=lambda objs, since: self.patch_refs(ctx, objs, since))
+
         if all_addresses is None:
-            all_addresses, _ = self.query(ctx, self.path)
+            if ctx.device_ids is None:
+                all_addresses, _ = self.query(ctx, self.path)
+            else:
+                all_addresses = self.query_by_devices(ctx, ctx.device_ids)
 
         self.all_addresses = []
+        addresses_by_assigned_object = {}
+
         for address in all_addresses:
             address["tags"] = [tag["slug"] for tag in address["tags"]]
             self.all_addresses.append(address)
 
+            if address["assigned_object_id"] is not None:
+                key = (address["assigned_object_type"], address["assigned_object_id"])
+                family = address["family"]["label"]
+                addresses_by_assigned_object.setdefault(key, { "IPv4": [], "IPv6": [] })[family].append(address)
+
         ctx.addresses = self.all_addresses
+        ctx.addresses_by_assigned_object = addresses_by_assigned_object
+        ctx.branches.rebuild("addresses", self.all_addresses,
+                             keys=lambda a: [ (tag, a["family"]["label"]) for tag in a["tags"] ])
         return self.all_addresses
 
 
-    def fetch_as_inventory(self, ctx, use_cache=False):
-        self.fetch_addresses(ctx, use_cache=use_cache)
+    def fetch_as_inventory(self, ctx, use_cache=False, sync_cache=False):
+        self.fetch_addresses(ctx, use_cache=use_cache, sync_cache=sync_cache)
 
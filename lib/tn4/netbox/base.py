@@ -1,7 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
 import json
 import os
 import requests
 
+from tn4.netbox.cache import backends, detect_backend
+from tn4.netbox.index import BranchIndex
+
 
 class Context:
     endpoint    = None  # ex) https://netbox.m.noc.titech.ac.jp:8000
@@ -16,46 +20,97 @@ class Context:
     interfaces  = None
 
     devices_by_hostname = None
+    addresses_by_assigned_object = None  # ex) ("dcim.interface", 123) -> { "IPv4": [...], "IPv6": [...] }
+    branches            = None  # BranchIndex of addresses, prefixes and fhrp groups
+    device_ids          = None  # restrict device-bound endpoints to these NetBox device IDs, or None for all
 
     def __init__(self, endpoint=None, token=None):
         self.endpoint = endpoint.rstrip("/")
         if self.endpoint[:4] != "/api":
             self.endpoint += "/api"
         self.token = token
+        self.branches = BranchIndex()
 
 
 class ClientBase:
-    def query(self, ctx, location, data=None, update=False, delete=False):
-        code = None
-        responses = []
-        url = ctx.endpoint + location
+    page_size    = 1000      # objects per page, NetBox may cap this with its MAX_PAGE_SIZE
+    max_workers  = 4         # concurrent page requests per endpoint, keep small not to overload NetBox
+    cache_format = "binary"  # format of the exported cache, "binary" or "json" (see tn4.netbox.cache)
 
-        headers = {
+    def __init__(self):
+        self.deferred_dumps = None  # arguments of dump() held until flush_dumps(), or None to export at once
+
+
+    @staticmethod
+    def request_headers(ctx):
+        return {
             "Authorization": f"Token {ctx.token}",
             "Content-Type":  "application/json",
             "Accept":        "application/json; indent=4"
         }
 
+
+    def fetch_page(self, url, headers, offset, limit, params=None):
+        params = { **(params or {}), "offset": offset, "limit": limit }
+        raw = requests.get(url, headers=headers, params=params, verify=True)
+
+        code = raw.status_code
+        if not 200 <= code < 300:
+            return None, code
+
+        return json.loads(raw.text), code
+
+
+    ## NOTE:
+    ## The first page tells the total number of objects in the "count" field,
+    ## so the remaining pages are requested in parallel instead of following the "next" link.
+    def fetch_all_pages(self, url, headers, params=None):
+        res, code = self.fetch_page(url, headers, 0, self.page_size, params)
+        if res is None:
+            return [], code  # early return
+
+        responses = res["results"]
+        limit = len(responses)  # actual page size accepted by NetBox
+
+        if res["next"] is None or limit == 0:
+            return responses, code  # early return
+
+        offsets = range(limit, res["count"], limit)
+        n_workers = max(1, min(self.max_workers, len(offsets)))
+
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            pages = list(executor.map(lambda offset: self.fetch_page(url, headers, offset, limit, params), offsets))
+
+        ## executor.map() keeps the order of offsets
+        for res, code in pages:
+            if res is None:
+                return [], code  # early return
+            responses += res["results"]
+
+        return responses, code
+
+
+    ## NOTE:
+    ## Responses filtered with 'params' are only a part of the endpoint,
+    ## so they are never exported as the local cache.
+    def query(self, ctx, location, data=None, update=False, delete=False, params=None):
+        code = None
+        responses = []
+        url = ctx.endpoint + location
+        headers = self.request_headers(ctx)
+
         if data is None:
             if delete:
                 raw  = requests.delete(url, headers=headers, verify=True)
                 code = raw.status_code
                 return code  # early return
 
-            while url:
-                raw = requests.get(url, headers=headers, verify=True)
-
-                code = raw.status_code
-                if not 200 <= code < 300:
-                    return [], code  # early return
+            responses, code = self.fetch_all_pages(url, headers, params)
+            if not 200 <= code < 300:
+                return [], code  # early return
 
-                res = json.loads(raw.text)
-                responses += res["results"]
-
-                ## If the "next" field has a URL, the results are not yet aligned.
-                url = res["next"]
-
-            self.dump(location, responses)
+            if params is None:
+                self.dump(location, responses)
 
         ## NOTE:
         ## To avoid the overload of NetBox,
@@ -80,6 +135,61 @@ class ClientBase:
         return responses, code
 
 
+    ## NOTE:
+    ## Bring the local cache up to date instead of downloading the whole endpoint again.
+    ## Objects changed since the high-water mark are merged into the cache,
+    ## and objects no longer listed in NetBox (brief mode, only IDs are used) are dropped.
+    ##  - patch: function rewriting the merged objects before they are exported, or None
+    ##           called as patch(objects, high-water mark of the cache), returning False if failed
+    ## NOTE:
+    ## The ID list is fetched before the changes, so that an object created in between is still
+    ## in the changes (it is missed until the next sync at worst, never kept after its deletion).
+    def sync(self, ctx, location, patch=None):
+        cached, ok = self.load(location)
+        meta = self.load_meta(location)
+
+        if not ok or meta is None or meta["last_updated"] is None:
+            return None, False  # early return, full fetch needed
+
+        url = ctx.endpoint + location
+        headers = self.request_headers(ctx)
+
+        current, code = self.fetch_all_pages(url, headers, { "brief": "true" })
+        if not 200 <= code < 300:
+            return None, False  # early return
+
+        updated, code = self.fetch_all_pages(url, headers, { "last_updated__gte": meta["last_updated"] })
+        if not 200 <= code < 300:
+            return None, False  # early return
+
+        objs  = { obj["id"]: obj for obj in cached }
+        objs |= { obj["id"]: obj for obj in updated }
+
+        ## Follow the order of NetBox, same as the full fetch
+        responses = [ objs[obj["id"]] for obj in current if obj["id"] in objs ]
+
+        if patch is not None and not patch(responses, meta["last_updated"]):
+            return None, False  # early return, full fetch needed
+
+        ## All objects may have been deleted, the empty cache is still up to date
+        self.dump(location, responses, allow_empty=True)
+        return responses, True
+
+
+    ## Return brief objects of the endpoint changed since the given time as a dict of ID and object, or None if failed
+    ## NOTE:
+    ## Brief objects have the same fields as the references embedded in the other objects (see tn4.netbox.refs).
+    def fetch_changed_refs(self, ctx, location, since):
+        url = ctx.endpoint + location
+        headers = self.request_headers(ctx)
+
+        objs, code = self.fetch_all_pages(url, headers, { "last_updated__gte": since, "brief": "true" })
+        if not 200 <= code < 300:
+            return None  # early return
+
+        return { obj["id"]: obj for obj in objs }
+
+
     @staticmethod
     def lookup_cache_file(location):
         ## If the response is from /dcim/interfaces/ then it is be exported as dcim-interfaces.cache
@@ -88,21 +198,45 @@ class ClientBase:
         return cache_name, cache_dir, cache_dir + "/" + cache_name
 
 
-    def dump(self, location, responses):
-        if len(responses) == 0: return  # early return
+    def dump(self, location, responses, allow_empty=False):
+        if len(responses) == 0 and not allow_empty: return  # early return
+
+        if self.deferred_dumps is not None:
+            self.deferred_dumps.append((location, responses, allow_empty))
+            return  # early return
 
         _, cache_dir, cache_path = self.lookup_cache_file(location)
         os.makedirs(cache_dir, exist_ok=True)
-        with open(cache_path, "w") as fd:
-            json.dump(responses, fd, indent=4, sort_keys=True, ensure_ascii=False)
+        backends[self.cache_format].dump(cache_path, location, responses)
+
+
+    def defer_dumps(self):
+        self.deferred_dumps = []
 
 
+    ## Export the caches held since defer_dumps(), or discard them if not commit
+    def flush_dumps(self, commit=True):
+        deferred, self.deferred_dumps = self.deferred_dumps or [], None
+        if commit:
+            for args in deferred:
+                self.dump(*args)
+
+
+    ## NOTE:
+    ## The cache may be exported in either format, it is detected by the leading bytes.
     def load(self, location):
         _, _, cache_path = self.lookup_cache_file(location)
         responses, ok = None, True
         try:
-            with open(cache_path) as fd:
-                responses = json.load(fd)
+            responses = detect_backend(cache_path).load(cache_path)
         except Exception as e:
             ok = False
         return responses, ok
+
+
+    def load_meta(self, location):
+        _, _, cache_path = self.lookup_cache_file(location)
+        try:
+            return detect_backend(cache_path).load_meta(cache_path)
+        except Exception as e:
+            return None
@@ -0,0 +1,126 @@
+from datetime import datetime
+import json
+import marshal
+import os
+import tempfile
+import zlib
+
+
+## Write the file via a temporary file in the same directory and an atomic rename,
+## so that a crashed or concurrent run never leaves a truncated cache behind
+def atomic_write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def build_meta(endpoint, responses):
+    return {
+        "endpoint":     endpoint,
+        "fetched_at":   datetime.now().astimezone().isoformat(),
+        "count":        len(responses),
+        ## High-water mark for the next sync, timestamps are compared on the NetBox side
+        "last_updated": max([ obj.get("last_updated") or "" for obj in responses ], default="") or None,
+    }
+
+
+## Human readable format for debugging, the metadata is exported as the '.meta' sidecar file
+class JsonCache:
+    name = "json"
+
+    @staticmethod
+    def match(head):
+        return head[:1] in [ b"[", b"{" ] or head[:1].isspace()
+
+
+    def dump(self, path, endpoint, responses):
+        meta = build_meta(endpoint, responses)
+        atomic_write(path, json.dumps(responses, indent=4, sort_keys=True, ensure_ascii=False).encode())
+        atomic_write(path + ".meta", json.dumps(meta, indent=4, sort_keys=True).encode())
+
+
+    def load(self, path):
+        with open(path, encoding="utf-8") as fd:
+            return json.load(fd)
+
+
+    def load_meta(self, path):
+        with open(path + ".meta") as fd:
+            return json.load(fd)
+
+
+## Compact format, which is:
+##   magic (8 bytes) | header length (4 bytes, big endian) | header (JSON) | payload (marshal + zlib)
+## NOTE:
+## The marshal format depends on the Python version, so the header records it
+## and the cache made by another version is treated as missing.
+class BinaryCache:
+    name   = "binary"
+    magic  = b"TN4CACHE"
+    schema = 1
+    level  = 1  # zlib compression level, favor the speed since the cache is loaded on every --use-cache run
+
+    @classmethod
+    def match(cls, head):
+        return head[:len(cls.magic)] == cls.magic
+
+
+    def dump(self, path, endpoint, responses):
+        header = {
+            **build_meta(endpoint, responses),
+            "schema":  self.schema,
+            "marshal": marshal.version,
+        }
+        header  = json.dumps(header, sort_keys=True).encode()
+        payload = zlib.compress(marshal.dumps(responses), self.level)
+
+        atomic_write(path, self.magic + len(header).to_bytes(4, "big") + header + payload)
+
+        ## Stale sidecar of the JSON format would shadow the header of this format
+        if os.path.exists(path + ".meta"):
+            os.unlink(path + ".meta")
+
+
+    def read_header(self, fd):
+        if not self.match(fd.read(len(self.magic))):
+            raise ValueError("not a binary cache")
+
+        header = json.loads(fd.read(int.from_bytes(fd.read(4), "big")))
+        if header["schema"] != self.schema or header["marshal"] != marshal.version:
+            raise ValueError("incompatible binary cache")
+
+        return header
+
+
+    def load(self, path):
+        with open(path, "rb") as fd:
+            self.read_header(fd)
+            return marshal.loads(zlib.decompress(fd.read()))
+
+
+    def load_meta(self, path):
+        with open(path, "rb") as fd:
+            return self.read_header(fd)
+
+
+backends = {
+    JsonCache.name:   JsonCache(),
+    BinaryCache.name: BinaryCache(),
+}
+
+
+## Choose the backend by the leading bytes, the cache may be written in either format
+def detect_backend(path):
+    with open(path, "rb") as fd:
+        head = fd.read(len(BinaryCache.magic))
+
+    for backend in backends.values():
+        if backend.match(head):
+            return backend
+
+    raise ValueError(f"unknown cache format: {path}")
@@ -1,5 +1,7 @@
-from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import time
 
+from tn4.helper.lazy import LazyVars
 from tn4.netbox.sites import Sites
 from tn4.netbox.vlans import Vlans
 from tn4.netbox.addresses import Addresses
@@ -11,6 +13,18 @@ from tn4.netbox.interfaces import Interfaces
 
 
 class Client:
+    ## Loading order of the endpoints, each one waits only for its own dependencies
+    dependencies = {
+        "sites":                  [],
+        "vlans":                  [],
+        "addresses":              [],
+        "prefixes":               [],
+        "fhrp_groups":            [],
+        "fhrp_group_assignments": [],
+        "devices":                [ "sites" ],
+        "interfaces":             [ "devices", "vlans", "addresses", "prefixes", "fhrp_groups", "fhrp_group_assignments" ],
+    }
+
     def __init__(self):
         self.sites       = Sites()
         self.vlans       = Vlans()
@@ -22,25 +36,74 @@ class Client:
         self.interfaces  = Interfaces()
 
 
+    def set_cache_format(self, cache_format):
+        for name in self.dependencies.keys():
+            getattr(self, name).cache_format = cache_format
+
+
     @staticmethod
     def merge_inventory(*inventories):
-        merged = deepcopy(inventories[0])
+        merged = dict(inventories[0])  # hostvars of the first inventory are replaced, not modified
         for inventory in inventories[1:]:
             for hostname in inventory.keys():
-                merged[hostname] |= inventory[hostname]
+                merged[hostname] = LazyVars(merged[hostname]) | inventory[hostname]  # keep lazy values pending
         return merged
 
 
-    def fetch_as_inventory(self, ctx, use_cache=False):
-        self.sites.fetch_as_inventory(ctx, use_cache=use_cache)
-        self.vlans.fetch_as_inventory(ctx, use_cache=use_cache)
-        self.addresses.fetch_as_inventory(ctx, use_cache=use_cache)
-        self.prefixes.fetch_as_inventory(ctx, use_cache=use_cache)
-        self.fhrp_groups.fetch_as_inventory(ctx, use_cache=use_cache)
-        self.fhrp_group_assignments.fetch_as_inventory(ctx, use_cache=use_cache)
+    ## Run fetch_as_inventory() of all endpoints as a dependency DAG
+    ##  - return:   dict of endpoint name and its fetch_as_inventory() result
+    ##  - callback: called in the caller's thread as callback(endpoint client, elapsed sec) on each completion
+    ##  - scope:    called in the caller's thread as scope(devices inventory) once devices are loaded,
+    ##              returning NetBox device IDs to restrict addresses and interfaces to, or None for all
+    def fetch_all(self, ctx, use_cache=False, sync_cache=False, callback=None, scope=None):
+        results = {}
+        pending = dict(self.dependencies)
+        running = {}
+
+        ## NOTE:
+        ## Whether the fetch is scoped is known only after the devices are loaded,
+        ## so the caches are held until then not to mix the full endpoints with the old scoped ones.
+        if scope is not None:
+            pending["addresses"] = [ "devices" ]  # addresses are also restricted to the scoped devices
+            for name in self.dependencies.keys():
+                getattr(self, name).defer_dumps()
+
+        def fetch(name):
+            start_at = time.time()
+            result = getattr(self, name).fetch_as_inventory(ctx, use_cache=use_cache, sync_cache=sync_cache)
+            return result, time.time() - start_at
+
+        with ThreadPoolExecutor(max_workers=len(self.dependencies)) as executor:
+            while pending or running:
+                for name, deps in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        running[executor.submit(fetch, name)] = name
+                        del pending[name]
+
+                done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    name = running.pop(future)
+                    results[name], et = future.result()  # re-raise the exception if any
+
+                    if callback is not None:
+                        callback(getattr(self, name), et)
+
+                    if name == "devices" and scope is not None:
+                        ctx.device_ids = scope(results[name])
+
+        ## The cache set is exported only if all endpoints were fetched in full
+        if scope is not None:
+            for name in self.dependencies.keys():
+                getattr(self, name).flush_dumps(commit=ctx.device_ids is None)
+
+        return results
+
+
+    def fetch_as_inventory(self, ctx, use_cache=False, sync_cache=False):
+        results = self.fetch_all(ctx, use_cache=use_cache, sync_cache=sync_cache)
 
         return self.merge_inventory(
-            self.devices.fetch_as_inventory(ctx, use_cache=use_cache),     # depending on sites
-            self.interfaces.fetch_as_inventory(ctx, use_cache=use_cache),  # depending on devices, vlans, and addresses
+            results["devices"],     # depending on sites
+            results["interfaces"],  # depending on devices, vlans, addresses, prefixes, and fhrp groups
         )
-
@@ -1,9 +1,20 @@
 import re
 
 from tn4.netbox.base import ClientBase
+from tn4.netbox.refs import resolve_all
 from tn4.netbox.slug import Slug
 
 
+## VRRP master Core SWs and their backup Core SWs configured as a pair
+VRRP_PAIRS = {
+    "core-honkan": "core-gsic",
+    "core-s7":     "core-s1",
+}
+
+VRRP_MASTERS = list(VRRP_PAIRS.keys())
+VRRP_BACKUPS = list(VRRP_PAIRS.values())
+
+
 class Devices(ClientBase):
     path = "/dcim/devices/"
 
@@ -12,12 +23,42 @@ class Devices(ClientBase):
     wifi_o2_area = [ Slug.SiteGroup.OokayamaEast, Slug.SiteGroup.OokayamaSouth,
                      Slug.SiteGroup.Ishikawadai ]
 
+    ## VRRP master and backup Core SWs and their peers
+    vrrp_peers   = VRRP_PAIRS | { backup: master for master, backup in VRRP_PAIRS.items() }
+    vrrp_masters = VRRP_MASTERS
+
     def __init__(self):
         super().__init__()
         self.all_devices = None
 
 
-    def fetch_devices(self, ctx, use_cache=False):
+    ## Return the given hostnames and the hostnames they depend on to build their inventory
+    def lookup_dependencies(self, ctx, hostnames):
+        dependencies = set(hostnames)
+
+        for hostname in hostnames:
+            if hostname in self.vrrp_peers:
+                dependencies.add(self.vrrp_peers[hostname])
+
+        return sorted(list(dependencies))
+
+
+    ## Return NetBox device IDs of the given hostnames, including all members of stacked edge SWs
+    def lookup_device_ids(self, ctx, hostnames):
+        return sorted([ device["id"] for device in ctx.devices.values() if device["hostname"] in hostnames ])
+
+
+    ## Rewrite the sites embedded in the synced devices, see ClientBase.sync()
+    def patch_refs(self, ctx, devices, since):
+        sites = self.fetch_changed_refs(ctx, "/dcim/sites/", since)
+        if sites is None:
+            return False  # early return
+
+        resolve_all(devices, "site", sites)
+        return True
+
+
+    def fetch_devices(self, ctx, use_cache=False, sync_cache=False):
         all_devices = None
 
         if use_cache:
@@ -25,6 +66,9 @@ class Devices(ClientBase):
                 return self.all_devices
             all_devices, _ = self.load(self.path)
 
+        elif sync_cache:
+            all_devices, _ = self.sync(ctx, self.path, patch=lambda objs, since: self.patch_refs(ctx, objs, since))
+
         if all_devices is None:
             all_devices, _ = self.query(ctx, self.path)
 
@@ -84,8 +128,8 @@ class Devices(ClientBase):
         return self.all_devices
 
 
-    def fetch_as_inventory(self, ctx, use_cache=False):
-        devices = self.fetch_devices(ctx, use_cache=use_cache)
+    def fetch_as_inventory(self, ctx, use_cache=False, sync_cache=False):
+        devices = self.fetch_devices(ctx, use_cache=use_cache, sync_cache=sync_cache)
 
         return {
             "_hostnames":     [ d["hostname"] for d in devices.values() ],
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+
+from tn4.doctor.branch import NB_BRANCH_ID_KEY
+from tn4.netbox.cache import detect_backend
+from tn4.netbox.slug import Slug
+
+
+## Load raw NetBox objects of the endpoints from the cache directory
+##  - return: dict of endpoint name and dict of object ID and object, or None if any cache is missing
+def load_snapshot(cache_dir, clients):
+    snapshot = {}
+
+    for name, client in clients.items():
+        cache_name, _, _ = client.lookup_cache_file(client.path)
+        cache_path = os.path.join(cache_dir, cache_name)
+
+        try:
+            objs = detect_backend(cache_path).load(cache_path)
+        except Exception as e:
+            return None  # early return
+
+        snapshot[name] = { obj["id"]: obj for obj in objs }
+
+    return snapshot
+
+
+def digest(obj):
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+## Changes between two snapshots of NetBox objects
+##  - changes:  dict of endpoint name and dict of object ID and (old object, new object)
+##              where the old or new object is None if the object is created or deleted
+class SnapshotDiff:
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+        self.changes = {}
+
+        for name in new.keys():
+            old_objs, new_objs = old.get(name, {}), new[name]
+            self.changes[name] = {
+                oid: (old_objs.get(oid), new_objs.get(oid))
+                for oid in old_objs.keys() | new_objs.keys()
+                if oid not in old_objs or oid not in new_objs or digest(old_objs[oid]) != digest(new_objs[oid])
+            }
+
+
+    def changed(self, name):
+        return [ obj for pair in self.changes.get(name, {}).values() for obj in pair if obj is not None ]
+
+
+    ## Return objects of both snapshots, old ones first
+    def both(self, name):
+        return [ *self.old.get(name, {}).values(), *self.new.get(name, {}).values() ]
+
+
+    def count(self):
+        return { name: len(changes) for name, changes in self.changes.items() }
+
+
+    @staticmethod
+    def lookup_vlan_ids(interface):
+        vlan_ids = { v["id"] for v in interface["tagged_vlans"] }
+        if interface["untagged_vlan"] is not None:
+            vlan_ids.add(interface["untagged_vlan"]["id"])
+        return vlan_ids
+
+
+    @staticmethod
+    def lookup_vids(interface):
+        vids = { v["vid"] for v in interface["tagged_vlans"] }
+        if interface["untagged_vlan"] is not None:
+            vids.add(interface["untagged_vlan"]["vid"])
+        return vids
+
+
+    @staticmethod
+    def lookup_branch_id(obj):
+        return obj["custom_fields"].get(NB_BRANCH_ID_KEY)
+
+
+    ## Return device names whose configs may be changed, propagating the changes as follows
+    ##  - site -> devices in the site
+    ##  - VLAN -> interfaces carrying it -> devices
+    ##  - irb, rspan interface -> VIDs of it -> interfaces carrying them -> devices (see Interfaces.fetch_vlans)
+    ##  - address, prefix, FHRP group -> branch -> IRBs of the branch -> Core SWs
+    ##  - address, FHRP group assignment -> assigned interface -> device
+    ##  - VLANs in use on Edge SW -> downlinks of Core SWs to the Edge SW (see check_edge_core_consistency)
+    def affected_devices(self, hostname_of):
+        devices = set()
+        interfaces_by_id = { i["id"]: i for i in self.both("interfaces") }
+        fhrp_groups_by_id = { g["id"]: g for g in self.both("fhrp_groups") }
+
+        for device in self.changed("devices"):
+            devices.add(device["name"])
+
+        site_ids = { site["id"] for site in self.changed("sites") }
+        for device in self.both("devices"):
+            if device["site"] is not None and device["site"]["id"] in site_ids:
+                devices.add(device["name"])
+
+        for interface in self.changed("interfaces"):
+            devices.add(interface["device"]["name"])
+
+        vlan_ids = { vlan["id"] for vlan in self.changed("vlans") }
+        for interface in self.both("interfaces"):
+            if self.lookup_vlan_ids(interface) & vlan_ids:
+                devices.add(interface["device"]["name"])
+
+        ## VLANs of irb and rspan interfaces are flagged on all devices carrying them
+        shared_vids = set()
+        for interface in self.changed("interfaces"):
+            if interface["name"][:4] == "irb." or interface["name"] == "rspan":
+                shared_vids |= self.lookup_vids(interface)
+
+        for interface in self.both("interfaces"):
+            if self.lookup_vids(interface) & shared_vids:
+                devices.add(interface["device"]["name"])
+
+        branch_ids = set()
+        for name in [ "addresses", "prefixes", "fhrp_groups" ]:
+            branch_ids |= { self.lookup_branch_id(obj) for obj in self.changed(name) }
+
+        interface_ids = set()
+        for address in self.changed("addresses"):
+            if address["assigned_object_type"] == "dcim.interface":
+                interface_ids.add(address["assigned_object_id"])
+            if address["assigned_object_type"] == "ipam.fhrpgroup" and address["assigned_object_id"] in fhrp_groups_by_id:
+                branch_ids.add(self.lookup_branch_id(fhrp_groups_by_id[address["assigned_object_id"]]))
+
+        for assignment in self.changed("fhrp_group_assignments"):
+            interface_ids.add(assignment["interface_id"])
+            if assignment["group"]["id"] in fhrp_groups_by_id:
+                branch_ids.add(self.lookup_branch_id(fhrp_groups_by_id[assignment["group"]["id"]]))
+
+        branch_ids.discard(None)
+        for interface in self.both("interfaces"):
+            if self.lookup_branch_id(interface) in branch_ids:
+                devices.add(interface["device"]["name"])
+
+        for interface_id in interface_ids:
+            if interface_id in interfaces_by_id:
+                devices.add(interfaces_by_id[interface_id]["device"]["name"])
+
+        ## Edge SWs whose VLANs in use are changed, Core SWs' downlinks follow them
+        edge_vlan_ids = {}
+        for snapshot in [ self.old, self.new ]:
+            vlan_ids = {}
+            for interface in snapshot.get("interfaces", {}).values():
+                hostname = hostname_of(interface["device"]["name"])
+                vlan_ids.setdefault(hostname, set()).update(self.lookup_vlan_ids(interface))
+            for hostname, ids in vlan_ids.items():
+                edge_vlan_ids.setdefault(hostname, []).append(ids)
+
+        changed_edges = { hostname for hostname, ids in edge_vlan_ids.items() if len(ids) != 2 or ids[0] != ids[1] }
+
+        for interface in self.both("interfaces"):
+            is_downlink = Slug.Tag.CoreDownstream in [ tag["slug"] for tag in interface["tags"] ]
+            if is_downlink and interface["description"] in changed_edges:
+                devices.add(interface["device"]["name"])
+
+        return devices
+
+
+    ## Return hostnames whose configs may be changed, stacked members are merged into one hostname
+    def affected_hosts(self, hostname_of):
+        hostnames = { hostname_of(name) for name in self.affected_devices(hostname_of) }
+        hostnames.discard(None)
+        return sorted(list(hostnames))
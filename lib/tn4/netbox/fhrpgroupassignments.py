@@ -47,7 +47,7 @@ class FhrpGroupAssignments(ClientBase):
         return self.query(ctx, self.path, data)
 
 
-    def fetch_fhrp_group_assignments(self, ctx, use_cache=False):
+    def fetch_fhrp_group_assignments(self, ctx, use_cache=False, sync_cache=False):
         all_fhrp_group_assignments = None
 
         if use_cache:
@@ -55,6 +55,9 @@ class FhrpGroupAssignments(ClientBase):
                 return self.all_fhrp_group_assignments
             all_fhrp_group_assignments, _ = self.load(self.path)
 
+        elif sync_cache:
+            all_fhrp_group_assignments, _ = self.sync(ctx, self.path)
+
         if all_fhrp_group_assignments is None:
             all_fhrp_group_assignments, _ = self.query(ctx, self.path)
 
@@ -66,6 +69,6 @@ class FhrpGroupAssignments(ClientBase):
         return self.all_fhrp_group_assignments
 
 
-    def fetch_as_inventory(self, ctx, use_cache=False):
-        self.fetch_fhrp_group_assignments(ctx, use_cache=use_cache)
+    def fetch_as_inventory(self, ctx, use_cache=False, sync_cache=False):
+        self.fetch_fhrp_group_assignments(ctx, use_cache=use_cache, sync_cache=sync_cache)
 
@@ -18,7 +18,7 @@ class FhrpGroups(ClientBase):
             self.fetch_fhrp_groups(ctx)
 
         cf_keys = cf.keys()
-        for fhrp_group in self.all_fhrp_groups.values():
+        for fhrp_group in ctx.branches.candidates("fhrp_groups", cf, self.all_fhrp_groups.values()):
             matched = True
             for cf_key in cf_keys:
                 if cf_key not in fhrp_group["custom_fields"]:
@@ -45,7 +45,7 @@ class FhrpGroups(ClientBase):
         return self.query(ctx, self.path, data)
 
 
-    def fetch_fhrp_groups(self, ctx, use_cache=False):
+    def fetch_fhrp_groups(self, ctx, use_cache=False, sync_cache=False):
         all_fhrp_groups = None
 
         if use_cache:
@@ -53,6 +53,9 @@ class FhrpGroups(ClientBase):
                 return self.all_fhrp_groups
             all_fhrp_groups, _ = self.load(self.path)
 
+        elif sync_cache:
+            all_fhrp_groups, _ = self.sync(ctx, self.path)
+
         if all_fhrp_groups is None:
             all_fhrp_groups, _ = self.query(ctx, self.path)
 
@@ -61,9 +64,10 @@ class FhrpGroups(ClientBase):
             self.all_fhrp_groups[fhrp_group["id"]] = fhrp_group
 
         ctx.fhrp_groups = self.all_fhrp_groups
+        ctx.branches.rebuild("fhrp_groups", self.all_fhrp_groups.values())
         return self.all_fhrp_groups
 
 
-    def fetch_as_inventory(self, ctx, use_cache=False):
-        self.fetch_fhrp_groups(ctx, use_cache=use_cache)
+    def fetch_as_inventory(self, ctx, use_cache=False, sync_cache=False):
+        self.fetch_fhrp_groups(ctx, use_cache=use_cache, sync_cache=sync_cache)
 
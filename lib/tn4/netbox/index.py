@@ -0,0 +1,51 @@
+from tn4.doctor.branch import NB_BRANCH_ID_KEY
+
+
+## Secondary index of NetBox objects by their branch ID (custom field)
+##  - primary key:    kind of objects (eg. "addresses", "prefixes", "fhrp_groups")
+##  - secondary key:  branch ID
+##  - value:          list of NetBox objects in the order of the endpoint
+## NOTE:
+## Objects are also bucketed by the keys given to rebuild() (eg. role tag and address family),
+## so that the callers need not sort the objects of a branch by themselves.
+class BranchIndex:
+    def __init__(self):
+        self.indexes = {}
+        self.buckets = {}
+
+
+    ## NOTE:
+    ## Endpoints are fetched concurrently, so each kind is built aside and then replaced at once.
+    ##  - keys: function returning the bucket keys of the object, or None not to bucket
+    def rebuild(self, kind, objs, keys=None):
+        index, buckets = {}, {}
+        for obj in objs:
+            branch_id = obj["custom_fields"].get(NB_BRANCH_ID_KEY)
+            if branch_id is None:
+                continue
+
+            index.setdefault(branch_id, []).append(obj)
+            for key in (keys(obj) if keys is not None else []):
+                buckets.setdefault((branch_id, key), []).append(obj)
+
+        self.indexes[kind] = index
+        self.buckets[kind] = buckets
+
+
+    def has(self, kind):
+        return kind in self.indexes
+
+
+    def lookup(self, kind, branch_id):
+        return self.indexes.get(kind, {}).get(branch_id, [])
+
+
+    def lookup_bucket(self, kind, branch_id, key):
+        return self.buckets.get(kind, {}).get((branch_id, key), [])
+
+
+    ## Narrow down the candidates of grep_by_custom_fields() if the branch ID is in the condition
+    def candidates(self, kind, cf, objs):
+        if NB_BRANCH_ID_KEY in cf and cf[NB_BRANCH_ID_KEY] is not None and self.has(kind):
+            return self.lookup(kind, cf[NB_BRANCH_ID_KEY])
+        return objs
@@ -1,12 +1,17 @@
 from pprint import pprint
 
 from tn4.netbox.base import ClientBase
+from tn4.netbox.devices import VRRP_MASTERS, VRRP_BACKUPS
+from tn4.netbox.refs import resolve_all
 from tn4.netbox.slug import Slug
+from tn4.netbox.vidset import VidSet
 from tn4.doctor.branch import NB_BRANCH_ID_KEY
+from tn4.helper.lazy import LazyVars
 
 
 class Interfaces(ClientBase):
     path = "/dcim/interfaces/"
+    max_workers = 8  # the largest endpoint of all
 
     ## Slugs of interface type name
     allowed_types_virtual = ["lag"]  # ignore virtual interfaces but irb
@@ -25,6 +30,7 @@ class Interfaces(ClientBase):
     def __init__(self):
         super().__init__()
         self.all_interfaces = None
+        self.shared_vids    = None  # irb and rspan VIDs of all devices, only set when devices are scoped
 
 
     def lookup_vlan_name(self, vlanid, ctx):
@@ -34,48 +40,32 @@ class Interfaces(ClientBase):
 
 
     def lookup_interface_address(self, ctx, ifid):
-        addr4, addr6 = [], []
-        for addr in ctx.addresses:
-            if addr["assigned_object_id"] == ifid:
-                if addr["family"]["label"] == "IPv4":
-                    addr4.append(addr["address"])
-                if addr["family"]["label"] == "IPv6":
-                    addr6.append(addr["address"])
+        addrs = ctx.addresses_by_assigned_object.get(("dcim.interface", ifid), { "IPv4": [], "IPv6": [] })
+        addr4 = [ addr["address"] for addr in addrs["IPv4"] ]
+        addr6 = [ addr["address"] for addr in addrs["IPv6"] ]
         return addr4, addr6
 
 
     def lookup_vrrp_addresses_by_branch_id(self, ctx, branch_id):
-        is_ipv4    = lambda a: '.' in a["address"]
-        is_ipv6    = lambda a: ':' in a["address"]
-        is_master  = lambda a: Slug.Tag.VRRPMaster in a["tags"]
-        is_backup  = lambda a: Slug.Tag.VRRPBackup in a["tags"]
-        is_virtual = lambda a: Slug.Tag.VRRPVirtual in a["tags"]
-
-        master4, backup4, vip4, master6, backup6, vip6 = None, None, None, None, None, None
-
-        for addr in ctx.addresses:
-            if addr["custom_fields"][NB_BRANCH_ID_KEY] == branch_id:
-                if is_ipv4(addr) and is_master(addr):
-                    master4 = addr["address"]
-                if is_ipv4(addr) and is_backup(addr):
-                    backup4 = addr["address"]
-                if is_ipv4(addr) and is_virtual(addr):
-                    vip4    = addr["address"]
-                if is_ipv6(addr) and is_master(addr):
-                    master6 = addr["address"]
-                if is_ipv6(addr) and is_backup(addr):
-                    backup6 = addr["address"]
-                if is_ipv6(addr) and is_virtual(addr):
-                    vip6    = addr["address"]
+        ## the last one is taken if the tag is duplicated in the branch
+        def lookup(tag, family):
+            addrs = ctx.branches.lookup_bucket("addresses", branch_id, (tag, family))
+            return addrs[-1]["address"] if len(addrs) > 0 else None
+
+        master4 = lookup(Slug.Tag.VRRPMaster,  "IPv4")
+        backup4 = lookup(Slug.Tag.VRRPBackup,  "IPv4")
+        vip4    = lookup(Slug.Tag.VRRPVirtual, "IPv4")
+        master6 = lookup(Slug.Tag.VRRPMaster,  "IPv6")
+        backup6 = lookup(Slug.Tag.VRRPBackup,  "IPv6")
+        vip6    = lookup(Slug.Tag.VRRPVirtual, "IPv6")
 
         ## all addresses are with CIDR length
         return master4, backup4, vip4, master6, backup6, vip6
 
 
     def lookup_vrrp_group_id_by_branch_id(self, ctx, branch_id):
-        for vrrp_group in ctx.fhrp_groups.values():
-            if vrrp_group["custom_fields"][NB_BRANCH_ID_KEY] == branch_id:
-                return vrrp_group["group_id"]
+        for vrrp_group in ctx.branches.lookup("fhrp_groups", branch_id):
+            return vrrp_group["group_id"]
         return None
 
 
@@ -85,16 +75,84 @@ class Interfaces(ClientBase):
 
         prefix4, prefix6 = None, None
 
-        for prefix in ctx.prefixes.values():
-            if prefix["custom_fields"][NB_BRANCH_ID_KEY] == branch_id:
-                if is_ipv4(prefix):
-                    prefix4 = prefix["prefix"]
-                if is_ipv6(prefix):
-                    prefix6 = prefix["prefix"]
+        for prefix in ctx.branches.lookup("prefixes", branch_id):
+            if is_ipv4(prefix):
+                prefix4 = prefix["prefix"]
+            if is_ipv6(prefix):
+                prefix6 = prefix["prefix"]
 
         return prefix4, prefix6
 
 
+    ## Return VIDs not in the given VidSet bits as chunks, computed lazily as 'absent_vids'
+    @staticmethod
+    def lookup_absent_vids(bits, packed_size):
+        return (~VidSet.from_bits(bits)).chunks(packed_size)
+
+
+    ## Return irb units (str) except ones actually existing as protected, computed lazily as 'unprotected_irb_units'
+    @staticmethod
+    def lookup_unprotected_irb_units(protected_units):
+        return [ str(i) for i in range(1, 4095) if str(i) not in protected_units ]
+
+
+    ## Return VIDs of the given raw NetBox interface, same as 'all_vids' of fetch_interfaces()
+    @staticmethod
+    def lookup_vids(interface):
+        vids = VidSet()
+
+        vlan_mode = interface["mode"]["value"].lower() if interface["mode"] is not None else None
+        if vlan_mode == "access" and interface["untagged_vlan"] is not None:
+            vids.add(interface["untagged_vlan"]["vid"])
+        elif vlan_mode == "tagged" and len(interface["tagged_vlans"]) > 0:
+            vids |= VidSet([ v["vid"] for v in interface["tagged_vlans"] ])
+            if interface["untagged_vlan"] is not None:
+                vids.add(interface["untagged_vlan"]["vid"])
+
+        return vids
+
+
+    ## Rewrite the VLANs embedded in the synced interfaces with the VLANs of ctx
+    ## NOTE:
+    ## Changing the VID or name of a VLAN, or deleting it, does not update 'last_updated' of the interfaces
+    ## carrying the VLAN, so the cached interfaces keep the old VLAN unless they are rewritten here.
+    def patch_vlans(self, ctx, interfaces):
+        def patch(vlan):
+            if vlan is None or vlan["id"] not in ctx.vlans:
+                return None
+            return vlan | { "vid": ctx.vlans[vlan["id"]]["vid"], "name": ctx.vlans[vlan["id"]]["name"] }
+
+        for interface in interfaces:
+            interface["untagged_vlan"] = patch(interface["untagged_vlan"])
+            interface["tagged_vlans"]  = [ v for v in map(patch, interface["tagged_vlans"]) if v is not None ]
+
+
+    ## Rewrite the references embedded in the synced interfaces, see ClientBase.sync()
+    def patch_refs(self, ctx, interfaces, since):
+        devices = self.fetch_changed_refs(ctx, "/dcim/devices/", since)
+        if devices is None:
+            return False  # early return
+
+        self.patch_vlans(ctx, interfaces)
+        resolve_all(interfaces, "device", devices)
+        resolve_all(interfaces, "lag", { interface["id"]: interface for interface in interfaces })
+        return True
+
+
+    ## VLANs used by irb and rspan interfaces are flagged campus-wide in fetch_vlans(),
+    ## so collect them from all devices even if the other interfaces are scoped
+    def query_shared_vids(self, ctx):
+        shared_vids = { "irb": VidSet(), "rspan": VidSet() }
+
+        for key, params in [ ("irb", { "name__isw": "irb." }), ("rspan", { "name": "rspan" }) ]:
+            interfaces, _ = self.query(ctx, self.path, params=params)
+            for interface in interfaces:
+                if interface["device"]["name"] in ctx.devices:
+                    shared_vids[key] |= self.lookup_vids(interface)
+
+        return shared_vids
+
+
     def delete(self, ctx, device_name, interface_name):
         try:
             oid = self.all_interfaces[device_name][interface_name]["id"]
@@ -197,7 +255,7 @@ class Interfaces(ClientBase):
     ##  - primary key:    hostname, not device name (eg. 'minami3', not 'minami3 (1)')
     ##  - secondary key:  interface name (eg. ge-0/0/0)
     ##  - value:          NetBox interface object
-    def fetch_interfaces(self, ctx, use_cache=False):
+    def fetch_interfaces(self, ctx, use_cache=False, sync_cache=False):
         all_interfaces = None
         hastag = lambda i, t: "tags" in i and t in i["tags"]
         hasrole = lambda i, r: ctx.devices[i["device"]["name"]]["role"] == r
@@ -207,8 +265,15 @@ class Interfaces(ClientBase):
                 return self.all_interfaces
             all_interfaces, _ = self.load(self.path)
 
+        elif sync_cache:
+            all_interfaces, _ = self.sync(ctx, self.path, patch=lambda objs, since: self.patch_refs(ctx, objs, since))
+
         if all_interfaces is None:
-            all_interfaces, _ = self.query(ctx, self.path)
+            if ctx.device_ids is None:
+                all_interfaces, _ = self.query(ctx, self.path)
+            else:
+                all_interfaces, _ = self.query(ctx, self.path, params={ "device_id": ctx.device_ids })
+                self.shared_vids = self.query_shared_vids(ctx)
 
         self.all_interfaces = {}
         for interface in all_interfaces:
@@ -260,14 +325,14 @@ class Interfaces(ClientBase):
 
                         interface["ra_prefix"] = prefix6
 
-                        if hostname in [ "core-honkan", "core-s7" ]:
+                        if hostname in VRRP_MASTERS:
                             interface |= {
                                 "apply_groups":      "VRRP-MASTER",
                                 "vrrp_physical_ip4": master4,  # master ipv4 (or None if missing)
                                 "vrrp_physical_ip6": master6,  # master ipv6 (or None if missing)
                             }
 
-                        if hostname in [ "core-gsic", "core-s1" ]:
+                        if hostname in VRRP_BACKUPS:
                             interface |= {
                                 "apply_groups":      "VRRP-BACKUP",
                                 "vrrp_physical_ip4": backup4,  # backup ipv4 (or None if missing)
@@ -319,7 +384,7 @@ class Interfaces(ClientBase):
             ##  - "*_vid*" is the actual VLAN ID (1..4094)
 
             all_vlanids = []
-            all_vids = []
+            all_vids = VidSet()
 
             interface |= {
                 "tagged_vlanids":  None,
@@ -341,7 +406,7 @@ class Interfaces(ClientBase):
                     "is_trunk_all":    False,
                 }
                 all_vlanids.append(interface["untagged_vlanid"])
-                all_vids.append(interface["untagged_vid"])
+                all_vids.add(interface["untagged_vid"])
 
                 ## use vlan name for interface description if it is empty
                 vlan_name = self.lookup_vlan_name(interface["untagged_vlan"]["id"], ctx)
@@ -356,13 +421,13 @@ class Interfaces(ClientBase):
                     "is_trunk_all":    False,
                 }
                 all_vlanids.extend(interface["tagged_vlanids"])
-                all_vids.extend(interface["tagged_vids"])
+                all_vids |= VidSet(interface["tagged_vids"])
 
                 if interface["untagged_vlan"] is not None:
                     interface["native_vlanid"] = interface["untagged_vlan"]["id"]
                     interface["native_vid"]    = interface["untagged_vlan"]["vid"]
                     all_vlanids.append(interface["untagged_vlan"]["id"])
-                    all_vids.append(interface["untagged_vlan"]["vid"])
+                    all_vids.add(interface["untagged_vlan"]["vid"])
 
             elif vlan_mode == "tagged-all" or is_upstream:
                 interface |= {
@@ -377,17 +442,20 @@ class Interfaces(ClientBase):
                     "is_trunk_all":    False,
                 }
 
+            ## NOTE:
+            ## VidSet is only used while building, hostvars keep plain lists to be exported as JSON
             interface |= {
                 "all_vlanids": sorted(list(set(all_vlanids))),
-                "all_vids":    sorted(list(set(all_vids))),
+                "all_vids":    all_vids.to_list(),  # sorted
             }
 
             ## for cisco edge
             manufacturer = ctx.devices[interface["device"]["name"]]["device_type"]["manufacturer"]["slug"]
             if manufacturer == Slug.Manufacturer.Cisco:
                 packed_size = 20
-                absent_vids = [vid for vid in range(1, 4095) if vid not in all_vids]
-                interface["absent_vids"] = [absent_vids[i:i+packed_size] for i in range(0, len(absent_vids), packed_size)]
+                interface = LazyVars(interface)
+                interface.declare("absent_vids", self.lookup_absent_vids, all_vids.bits, packed_size)
+                interface["all_vid_ranges"] = all_vids.ranges()  # eg. "1-99,101-4094"
 
             addr4, addr6 = self.lookup_interface_address(ctx, interface["id"])
             interface |= {
@@ -455,7 +523,7 @@ class Interfaces(ClientBase):
         if self.all_interfaces is None:
             self.fetch_interfaces()
 
-        irb_vids, rspan_vids = [], []
+        irb_vids, rspan_vids = VidSet(), VidSet()
 
         for hostname, interfaces in self.all_interfaces.items():
             used_vlanids = []
@@ -464,14 +532,17 @@ class Interfaces(ClientBase):
                 used_vlanids.extend(interface["all_vlanids"])
 
                 if interface["is_irb"]:
-                    irb_vids.extend(interface["all_vids"])
+                    irb_vids |= VidSet(interface["all_vids"])
                 if interface["is_rspan"]:
-                    rspan_vids.extend(interface["all_vids"])
+                    rspan_vids |= VidSet(interface["all_vids"])
 
                 regions[hostname] = interface["region"]
                 roles[hostname] = interface["role"]
 
-            all_used_vlanids[hostname] = list(set(used_vlanids))
+            all_used_vlanids[hostname] = set(used_vlanids)
+
+        if self.shared_vids is not None:
+            irb_vids, rspan_vids = self.shared_vids["irb"], self.shared_vids["rspan"]
 
         for hostname, used_vlanids in all_used_vlanids.items():
             region = regions[hostname]
@@ -499,8 +570,8 @@ class Interfaces(ClientBase):
         return used_vlans, mgmt_vlans
 
 
-    def fetch_as_inventory(self, ctx, use_cache=False):
-        all_interfaces = self.fetch_interfaces(ctx, use_cache=use_cache)
+    def fetch_as_inventory(self, ctx, use_cache=False, sync_cache=False):
+        all_interfaces = self.fetch_interfaces(ctx, use_cache=use_cache, sync_cache=sync_cache)
         all_lag_members = self.fetch_lag_members(ctx)  # following fetch_interfaces()
         used_vlans, mgmt_vlans = self.fetch_vlans(ctx)
 
@@ -513,12 +584,11 @@ class Interfaces(ClientBase):
         }
 
         ## skip actually existing units having protect tags (= all branch-scope units)
-        unprotected_irb_units = {
-            hostname: [
-                str(i)
-                for i in range(1,4095)
-                if not ( f"irb.{i}" in interfaces and interfaces[f"irb.{i}"]["is_deploy_target"] == False )
-            ]
+        protected_irb_units = {
+            hostname: {
+                interface["unit_number"]
+                for interface in interfaces.values() if interface["is_irb"] and interface["is_deploy_target"] == False
+            }
             for hostname, interfaces in all_interfaces.items()
         }
 
@@ -530,14 +600,17 @@ class Interfaces(ClientBase):
             for hostname, lag_members in all_lag_members.items()
         }
 
-        return {
-            hostname: {
+        inventory = {}
+        for hostname in all_interfaces.keys():
+            inventory[hostname] = LazyVars({
                 "interfaces":  target_interfaces[hostname],   # key: interface name, value: interface object
                 "lag_members": target_lag_members[hostname],  # key: parent name, value: list of members' name
                 "vlans":       used_vlans[hostname],          # list of extended VLAN object
                 "mgmt_vlan":   mgmt_vlans[hostname],          # a VLAN object
-                "unprotected_irb_units": unprotected_irb_units[hostname],  # list of str
-            }
-            for hostname in all_interfaces.keys()
-        }
+            })
+
+            ## list of str, computed on the first read
+            inventory[hostname].declare("unprotected_irb_units", self.lookup_unprotected_irb_units, protected_irb_units[hostname])
+
+        return inventory
 
@@ -37,7 +37,7 @@ class Prefixes(ClientBase):
 
         prefixes = []
 
-        for prefix in self.all_prefixes.values():
+        for prefix in ctx.branches.candidates("prefixes", cf, self.all_prefixes.values()):
             matched = True
             for cf_key in cf.keys():
                 if cf_key not in prefix["custom_fields"]:
@@ -53,7 +53,7 @@ class Prefixes(ClientBase):
         return prefixes
 
 
-    def fetch_prefixes(self, ctx, use_cache=False):
+    def fetch_prefixes(self, ctx, use_cache=False, sync_cache=False):
         all_prefixes = None
 
         if use_cache:
@@ -61,6 +61,9 @@ class Prefixes(ClientBase):
                 return self.all_prefixes
             all_prefixes, _ = self.load(self.path)
 
+        elif sync_cache:
+            all_prefixes, _ = self.sync(ctx, self.path)
+
         if all_prefixes is None:
             all_prefixes, _ = self.query(ctx, self.path)
 
@@ -69,9 +72,10 @@ class Prefixes(ClientBase):
             self.all_prefixes[prefix["id"]] = prefix
 
         ctx.prefixes = self.all_prefixes
+        ctx.branches.rebuild("prefixes", self.all_prefixes.values())
         return self.all_prefixes
 
 
-    def fetch_as_inventory(self, ctx, use_cache=False):
-        self.fetch_prefixes(ctx, use_cache=use_cache)
+    def fetch_as_inventory(self, ctx, use_cache=False, sync_cache=False):
+        self.fetch_prefixes(ctx, use_cache=use_cache, sync_cache=sync_cache)
 
@@ -0,0 +1,20 @@
+## References embedded in NetBox objects (eg. 'device' of an interface, 'assigned_object' of an address)
+## NOTE:
+## Renaming the referenced object does not update 'last_updated' of the referencing objects,
+## so the references in the synced cache are resolved again with the referenced objects changed since then.
+
+
+## Return the reference with its fields replaced by the ones of the referenced object, if it is in objs
+##  - objs: dict of object ID and (brief or full) object
+def resolve(ref, objs):
+    if ref is None or ref["id"] not in objs:
+        return ref  # early return
+
+    return ref | { k: v for k, v in objs[ref["id"]].items() if k in ref }
+
+
+## Resolve the reference of the key in all objects in place
+def resolve_all(objs, key, referenced):
+    for obj in objs:
+        if obj.get(key) is not None:
+            obj[key] = resolve(obj[key], referenced)
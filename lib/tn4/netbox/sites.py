@@ -9,7 +9,7 @@ class Sites(ClientBase):
         self.all_sites = None
 
 
-    def fetch_sites(self, ctx, use_cache=False):
+    def fetch_sites(self, ctx, use_cache=False, sync_cache=False):
         all_sites = None
 
         if use_cache:
@@ -17,6 +17,9 @@ class Sites(ClientBase):
                 return self.all_sites
             all_sites, _ = self.load(self.path)
 
+        elif sync_cache:
+            all_sites, _ = self.sync(ctx, self.path)
+
         if all_sites is None:
             all_sites, _ = self.query(ctx, self.path)
 
@@ -28,6 +31,6 @@ class Sites(ClientBase):
         return self.all_sites
 
 
-    def fetch_as_inventory(self, ctx, use_cache=False):
-        self.fetch_sites(ctx, use_cache=use_cache)
+    def fetch_as_inventory(self, ctx, use_cache=False, sync_cache=False):
+        self.fetch_sites(ctx, use_cache=use_cache, sync_cache=sync_cache)
 
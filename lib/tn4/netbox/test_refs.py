@@ -0,0 +1,45 @@
+import unittest
+
+from refs import resolve, resolve_all
+
+
+class TestRefs(unittest.TestCase):
+
+    def setUp(self):
+        ## brief devices changed since the last sync
+        self.devices = { 1: { "id": 1, "url": "/dcim/devices/1/", "display": "minami3", "name": "minami3" } }
+
+    def test_resolve(self):
+        ref = { "id": 1, "url": "/dcim/devices/1/", "display": "minami", "name": "minami" }
+        self.assertEqual(resolve(ref, self.devices)["name"], "minami3")
+        self.assertEqual(resolve({ "id": 2, "name": "ishikawa" }, self.devices), { "id": 2, "name": "ishikawa" })
+        self.assertIsNone(resolve(None, self.devices))
+
+    def test_fields_of_reference_only(self):
+        devices = { 1: { "id": 1, "name": "minami3", "serial": "ABC" } }
+        self.assertEqual(resolve({ "id": 1, "name": "minami" }, devices), { "id": 1, "name": "minami3" })
+
+    def test_resolve_all(self):
+        interfaces = [
+            { "id": 10, "name": "ge-0/0/0", "device": { "id": 1, "name": "minami" }, "lag": { "id": 11, "name": "ae0" } },
+            { "id": 11, "name": "ae1", "device": { "id": 1, "name": "minami" }, "lag": None },
+        ]
+        resolve_all(interfaces, "device", self.devices)
+        resolve_all(interfaces, "lag", { i["id"]: i for i in interfaces })
+
+        self.assertEqual([ i["device"]["name"] for i in interfaces ], [ "minami3", "minami3" ])
+        self.assertEqual(interfaces[0]["lag"], { "id": 11, "name": "ae1" })
+        self.assertIsNone(interfaces[1]["lag"])
+
+    def test_nested(self):
+        ## assigned object of an address, its device is also embedded
+        addresses = [ { "assigned_object": { "id": 10, "name": "ge-0/0/0", "device": { "id": 1, "name": "minami" } } } ]
+        resolve_all(addresses, "assigned_object", { 10: { "id": 10, "name": "ge-0/0/1", "device": { "id": 1, "name": "minami" } } })
+        resolve_all([ a["assigned_object"] for a in addresses ], "device", self.devices)
+
+        self.assertEqual(addresses[0]["assigned_object"]["name"], "ge-0/0/1")
+        self.assertEqual(addresses[0]["assigned_object"]["device"]["name"], "minami3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from vidset import VidSet
+
+
+class TestVidSet(unittest.TestCase):
+
+    def test_members(self):
+        a = VidSet([10, 1, 4094, 10])
+        self.assertEqual(list(a), [1, 10, 4094])
+        self.assertEqual(len(a), 3)
+        self.assertTrue(10 in a)
+        self.assertFalse(11 in a)
+        self.assertFalse(0 in a)
+        self.assertFalse(VidSet())
+
+    def test_out_of_range(self):
+        self.assertRaises(ValueError, VidSet, [0])
+        self.assertRaises(ValueError, VidSet, [4095])
+
+    def test_operators(self):
+        a = VidSet([1, 2, 3])
+        b = VidSet([3, 4])
+        self.assertEqual(a | b, VidSet([1, 2, 3, 4]))
+        self.assertEqual(a & b, VidSet([3]))
+        self.assertEqual(a - b, VidSet([1, 2]))
+
+        a |= b
+        self.assertEqual(a, VidSet([1, 2, 3, 4]))
+
+    def test_complement(self):
+        a = VidSet([100])
+        self.assertEqual(len(~a), 4093)
+        self.assertFalse(100 in ~a)
+        self.assertEqual(~VidSet(), VidSet.full())
+        self.assertEqual(~VidSet.full(), VidSet())
+
+    def test_ranges(self):
+        self.assertEqual((~VidSet([100])).ranges(), "1-99,101-4094")
+        self.assertEqual(VidSet([5, 7, 8, 9, 4094]).ranges(), "5,7-9,4094")
+        self.assertEqual(VidSet.full().ranges(), "1-4094")
+        self.assertEqual(VidSet().ranges(), "")
+
+    def test_chunks(self):
+        a = VidSet(range(1, 46))
+        chunks = a.chunks(20)
+        self.assertEqual([ len(c) for c in chunks ], [20, 20, 5])
+        self.assertEqual(chunks[2], [41, 42, 43, 44, 45])
+
+        absent = [ vid for vid in range(1, 4095) if vid not in [3, 50] ]
+        self.assertEqual((~VidSet([3, 50])).chunks(20), [ absent[i:i+20] for i in range(0, len(absent), 20) ])
+
+
+if __name__ == "__main__":
+    unittest.main()
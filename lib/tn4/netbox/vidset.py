@@ -0,0 +1,116 @@
+## Set of VLAN IDs (1..4094) as a 4096-bit bitmap
+##  - bit N is set if VID N is a member, bit 0 and 4095 are never set
+##  - iteration is always in ascending order
+class VidSet:
+    vid_min = 1
+    vid_max = 4094
+    all_bits = ((1 << (vid_max + 1)) - 1) ^ ((1 << vid_min) - 1)
+
+    def __init__(self, vids=()):
+        self.bits = 0
+        for vid in vids:
+            self.add(vid)
+
+
+    @classmethod
+    def from_bits(cls, bits):
+        vidset = cls()
+        vidset.bits = bits & cls.all_bits
+        return vidset
+
+
+    @classmethod
+    def full(cls):
+        return cls.from_bits(cls.all_bits)
+
+
+    def add(self, vid):
+        if not self.vid_min <= vid <= self.vid_max:
+            raise ValueError(f"VLAN ID out of range: {vid}")
+        self.bits |= 1 << vid
+
+
+    def discard(self, vid):
+        self.bits &= ~(1 << vid)
+
+
+    def __contains__(self, vid):
+        return isinstance(vid, int) and vid >= 0 and (self.bits >> vid) & 1 == 1
+
+
+    def __iter__(self):
+        bits = self.bits
+        while bits:
+            lowest = bits & -bits
+            yield lowest.bit_length() - 1
+            bits ^= lowest
+
+
+    def __len__(self):
+        return bin(self.bits).count("1")
+
+
+    def __bool__(self):
+        return self.bits != 0
+
+
+    def __eq__(self, other):
+        return isinstance(other, VidSet) and self.bits == other.bits
+
+
+    def __hash__(self):
+        return hash(self.bits)
+
+
+    def __or__(self, other):
+        return VidSet.from_bits(self.bits | other.bits)
+
+
+    def __and__(self, other):
+        return VidSet.from_bits(self.bits & other.bits)
+
+
+    def __sub__(self, other):
+        return VidSet.from_bits(self.bits & ~other.bits)
+
+
+    ## complement within 1..4094
+    def __invert__(self):
+        return VidSet.from_bits(self.all_bits & ~self.bits)
+
+
+    def __ior__(self, other):
+        self.bits |= other.bits
+        return self
+
+
+    def __repr__(self):
+        return f"VidSet('{self.ranges()}')"
+
+
+    def to_list(self):
+        return list(self)
+
+
+    ## Return list of (first, last) tuples of consecutive VIDs
+    def spans(self):
+        spans = []
+        bits = self.bits
+        while bits:
+            first = (bits & -bits).bit_length() - 1
+            run   = (bits >> first) ^ ((bits >> first) + 1)  # ones up to and including the first zero
+            last  = first + run.bit_length() - 2
+            spans.append((first, last))
+            bits &= ~((1 << (last + 1)) - 1)
+        return spans
+
+
+    ## Return range compressed string (eg. "1-99,101-4094")
+    def ranges(self, sep=","):
+        return sep.join([ str(f) if f == l else f"{f}-{l}" for f, l in self.spans() ])
+
+
+    ## Return list of VID lists having 'size' VIDs at most
+    def chunks(self, size):
+        vids = self.to_list()
+        return [ vids[i:i+size] for i in range(0, len(vids), size) ]
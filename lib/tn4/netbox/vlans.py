@@ -33,7 +33,7 @@ class Vlans(ClientBase):
     ## Return all VLANs as a dict object
     ##  - key:   VLAN object ID (NetBox internal ID)
     ##  - value: VLAN object
-    def fetch_vlans(self, ctx, use_cache=False):
+    def fetch_vlans(self, ctx, use_cache=False, sync_cache=False):
         all_vlans = None
 
         if use_cache:
@@ -41,6 +41,9 @@ class Vlans(ClientBase):
                 return self.all_vlans
             all_vlans, _ = self.load(self.path)
 
+        elif sync_cache:
+            all_vlans, _ = self.sync(ctx, self.path)
+
         if all_vlans is None:
             all_vlans, _ = self.query(ctx, self.path)
 
@@ -57,9 +60,9 @@ class Vlans(ClientBase):
     ## Return Titech VLANs as a dict object
     ##  - key:   VID (1..4094)
     ##  - value: VLAN object
-    def fetch_titech_vlans(self, ctx, use_cache=False):
+    def fetch_titech_vlans(self, ctx, use_cache=False, sync_cache=False):
         if self.all_vlans is None:
-            self.fetch_vlans(ctx, use_cache=use_cache)
+            self.fetch_vlans(ctx, use_cache=use_cache, sync_cache=sync_cache)
 
         groupid = str(self.titech_vlan_group_id)
         titech_vlans = {}
@@ -71,6 +74,6 @@ class Vlans(ClientBase):
         return titech_vlans
 
 
-    def fetch_as_inventory(self, ctx, use_cache=False):
-        self.fetch_titech_vlans(ctx, use_cache=use_cache)
+    def fetch_as_inventory(self, ctx, use_cache=False, sync_cache=False):
+        self.fetch_titech_vlans(ctx, use_cache=use_cache, sync_cache=sync_cache)
 